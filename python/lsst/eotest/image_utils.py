@@ -19,6 +19,11 @@ import lsst.afw.math as afwMath
 class Metadata(object):
     def __init__(self, infile, hdu=0):
         self.header = None
+        if isinstance(infile, fits.HDUList):
+            # In-memory FITS data.
+            self.header = dict()
+            self.header.update(infile[hdu].header)
+            return
         try:
             self.md = afwImage.readMetadata(infile, dm_hdu(hdu))
         except:
@@ -42,23 +47,30 @@ def allAmps(fits_file=None):
     all_amps = list(range(1, 17))
     if fits_file is None:
         return all_amps
+    if isinstance(fits_file, fits.HDUList):
+        return _hdulist_amps(fits_file, all_amps)
     with fits.open(fits_file) as f:
-        try:
-            # Get the number of amps from the FITS header if this is
-            # ptc or detector response file.
-            namps = f[0].header['NAMPS']
-        except KeyError:
-            # Otherwise, this is a raw image FITS file, so infer the
-            # number of amps from the number of extensions.
-            if len(f) <= 12:
-                # Wavefront sensor
-                return list(range(1, 9))
-            else:
-                # Full 16 amp sensor.
-                return all_amps
+        return _hdulist_amps(f, all_amps)
+
+
+def _hdulist_amps(f, all_amps):
+    """Infer the list of amps from an opened FITS file."""
+    try:
+        # Get the number of amps from the FITS header if this is
+        # ptc or detector response file.
+        namps = f[0].header['NAMPS']
+    except KeyError:
+        # Otherwise, this is a raw image FITS file, so infer the
+        # number of amps from the number of extensions.
+        if len(f) <= 12:
+            # Wavefront sensor
+            return list(range(1, 9))
         else:
-            # Number of amps specified in the FITS file header.
-            return list(range(1, namps + 1))
+            # Full 16 amp sensor.
+            return all_amps
+    else:
+        # Number of amps specified in the FITS file header.
+        return list(range(1, namps + 1))
 
 
 # Segment ID to HDU number in FITS dictionary
@@ -586,8 +598,15 @@ def fits_mean_file(files, outfile, overwrite=True, bitpix=32):
 
 def fits_median(files, hdu=2, fix=True):
     """Compute the median image from a set of image FITS files."""
-    ims = [afwImage.ImageF(f, hdu) for f in files]
-    exptimes = [Metadata(f).get('EXPTIME') for f in files]
+    # Read the pixel data and the exposure time from a single
+    # memory-mapped open of each file.  The astropy HDU index is
+    # offset from the DM HDU number for older versions of afw.
+    ims, exptimes = [], []
+    for item in files:
+        with fits.open(item, memmap=True) as hdulist:
+            exptimes.append(hdulist[0].header['EXPTIME'])
+            ims.append(afwImage.ImageF(
+                np.array(hdulist[hdu - dm_hdu(0)].data, dtype=np.float32)))
 
     if min(exptimes) != max(exptimes):
         raise RuntimeError("Error: unequal exposure times")
@@ -752,6 +771,18 @@ def rebin(image, binsize, use_mean=False):
     return output_image
 
 
+def footprint_pixels(fp):
+    """
+    Return the x and y pixel indices of all of the pixels in a
+    footprint as a pair of numpy arrays.
+    """
+    x0s, x1s, ys = zip(*[(span.getX0(), span.getX1(), span.getY())
+                         for span in fp.getSpans()])
+    xs = np.concatenate([np.arange(x0, x1 + 1) for x0, x1 in zip(x0s, x1s)])
+    ys = np.repeat(ys, np.array(x1s) - np.array(x0s) + 1)
+    return xs, ys
+
+
 if __name__ == '__main__':
     import glob
 
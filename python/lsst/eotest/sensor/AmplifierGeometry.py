@@ -3,6 +3,7 @@ Code to encapsulate amplifier geometry as expressed in NOAO image
 section keywords DETSEC, DATASEC, DETSIZE.
 """
 from __future__ import print_function
+import numpy as np
 import astropy.io.fits as fits
 
 __all__ = ['AmplifierGeometry', 'makeAmplifierGeometry', 'amp_loc',
@@ -29,9 +30,16 @@ def parse_geom_kwd(value):
 
 def makeAmplifierGeometry(infile):
     """
-    Make an AmplifierGeometry object from an input FITS file.
+    Make an AmplifierGeometry object from an input FITS file or an
+    already opened astropy.io.fits.HDUList.  Only the headers are read.
     """
-    foo = fits.open(infile)
+    if isinstance(infile, fits.HDUList):
+        return _makeAmplifierGeometry(infile)
+    with fits.open(infile) as hdulist:
+        return _makeAmplifierGeometry(hdulist)
+
+
+def _makeAmplifierGeometry(foo):
     detsize = parse_geom_kwd(foo[0].header['DETSIZE'])
     datasec = parse_geom_kwd(foo[1].header['DATASEC'])
     prescan = datasec['xmin'] - 1
@@ -54,8 +62,7 @@ def makeAmplifierGeometry(infile):
                                   detysize=detsize['ymax'],
                                   amp_loc=amp_loc[vendor],
                                   vendor=vendor)
-    myAmpGeom.compute_geometry(fitsfile=infile)
-    foo.close()
+    myAmpGeom.compute_geometry(header=foo[1].header)
     return myAmpGeom
 
 
@@ -74,15 +81,18 @@ class AmplifierGeometry(dict):
         self.compute_geometry(detxsize=detxsize, detysize=detysize)
 
     def compute_geometry(self, **kwds):
-        if 'fitsfile' in kwds:
+        if 'fitsfile' in kwds or 'header' in kwds:
             # Compute geometry by inferring DETSIZE from NAXIS[12] in
-            # first image extension of specified FITS file.
-            foo = fits.open(kwds['fitsfile'])
-            self.naxis1 = foo[1].header['NAXIS1']
-            self.naxis2 = foo[1].header['NAXIS2']
+            # first image extension of specified FITS file or from
+            # the supplied header of that extension.
+            if 'header' in kwds:
+                header = kwds['header']
+            else:
+                header = fits.getheader(kwds['fitsfile'], 1)
+            self.naxis1 = header['NAXIS1']
+            self.naxis2 = header['NAXIS2']
             detxsize = self.naxis1*self.nsegx
             detysize = self.naxis2*self.nsegy
-            foo.close()
         else:
             # Compute geometry using supplied detxsize, detysize
             detxsize = kwds['detxsize']
@@ -95,8 +105,21 @@ class AmplifierGeometry(dict):
             self._make_bboxes()
         except ImportError:
             pass
-        for amp in range(1, self.nsegx*self.nsegy + 1):
-            self[amp] = self._segment_geometry(amp)
+        # These section strings are the same for all segments, so
+        # format them just once.
+        self._detsize = '[1:%i,1:%i]' % (self.nx*self.nsegx,
+                                         self.ny*self.nsegy)
+        self._datasec = \
+            '[%i:%i,%i:%i]' % (self.prescan_width + 1,
+                               self.naxis1 - self.serial_overscan_width,
+                               1, self.ny)
+        self._biassec = \
+            '[%i:%i,%i:%i]' % (self.prescan_width + self.nx + 1,
+                               self.naxis1,
+                               1, self.ny)
+        amps = np.arange(1, self.nsegx*self.nsegy + 1)
+        for amp, detsec in zip(amps.tolist(), self._detsecs(amps)):
+            self[amp] = self._segment_geometry(detsec)
 
     def _make_bboxes(self):
         import lsst.geom as lsstGeom
@@ -119,38 +142,30 @@ class AmplifierGeometry(dict):
                            lsstGeom.Point2I(self.prescan_width + self.nx,
                                             self.naxis2 - 1))
 
-    def _segment_geometry(self, amp):
+    def _segment_geometry(self, detsec):
         results = dict()
-        results['DETSIZE'] = '[1:%i,1:%i]' % (self.nx*self.nsegx,
-                                              self.ny*self.nsegy)
-        results['DATASEC'] = \
-            '[%i:%i,%i:%i]' % (self.prescan_width + 1,
-                               self.naxis1 - self.serial_overscan_width,
-                               1, self.ny)
-        results['DETSEC'] = self._detsec(amp)
-        results['BIASSEC'] = \
-            '[%i:%i,%i:%i]' % (self.prescan_width + self.nx + 1,
-                               self.naxis1,
-                               1, self.ny)
+        results['DETSIZE'] = self._detsize
+        results['DATASEC'] = self._datasec
+        results['DETSEC'] = detsec
+        results['BIASSEC'] = self._biassec
         return results
 
-    def _detsec(self, amp):
+    def _detsecs(self, amps):
         namps = self.nsegx*self.nsegy
-        if amp <= self.nsegx:
-            x1 = (amp - 1)*self.nx + 1
-            x2 = amp*self.nx
-            y1, y2 = 1, self.ny
-        else:
-            # Amps in "top half" of CCD, where the ordering of amps 9
-            # to 16 is right-to-left.
-            x1 = (namps - amp)*self.nx + 1
-            x2 = (namps - amp + 1)*self.nx
-            # Flip in y for top half of sensor.
-            y1, y2 = 2*self.ny, self.ny + 1
-        if self.amp_loc[amp] < 0:
-            # Flip since the output node is on the right side of segment.
-            x1, x2 = x2, x1
-        return '[%i:%i,%i:%i]' % (x1, x2, y1, y2)
+        bottom = amps <= self.nsegx
+        # Amps in "top half" of CCD, where the ordering of amps 9
+        # to 16 is right-to-left.
+        x1 = np.where(bottom, (amps - 1)*self.nx + 1,
+                      (namps - amps)*self.nx + 1)
+        x2 = x1 + self.nx - 1
+        # Flip in y for top half of sensor.
+        y1 = np.where(bottom, 1, 2*self.ny)
+        y2 = np.where(bottom, self.ny, self.ny + 1)
+        # Flip in x where the output node is on the right side of
+        # the segment.
+        flip = np.array([self.amp_loc[amp] < 0 for amp in amps.tolist()])
+        x1, x2 = np.where(flip, x2, x1), np.where(flip, x1, x2)
+        return ['[%i:%i,%i:%i]' % item for item in zip(x1, x2, y1, y2)]
 
     def __eq__(self, other):
         for key in list(self.__dict__.keys()):
@@ -5,6 +5,7 @@ afwMath.makeStatistics object.
 
 @author J. Chiang <jchiang@slac.stanford.edu>
 """
+import contextlib
 import warnings
 import numpy as np
 import astropy.io.fits as fits
@@ -26,6 +27,28 @@ except AttributeError:
     afwImage_Mask = afwImage.MaskU
 
 
+def _is_sim_ccd(infile):
+    """
+    Check if infile is a simulated sim_tools.CCD object.  Since
+    sim_tools imports this module, check the interface rather than
+    the type.
+    """
+    return hasattr(infile, 'segments') and hasattr(infile, 'to_hdulist')
+
+
+def _open_fits(infile, **kwds):
+    """
+    Context manager that opens a FITS file, or uses an
+    astropy.io.fits.HDUList of in-memory data as is.  A simulated
+    sim_tools.CCD object is converted to an HDUList.
+    """
+    if isinstance(infile, fits.HDUList):
+        return contextlib.nullcontext(infile)
+    if _is_sim_ccd(infile):
+        return contextlib.nullcontext(infile.to_hdulist(bitpix=-32))
+    return fits.open(infile, **kwds)
+
+
 class MaskedCCDBiasImageException(RuntimeError):
     def __init__(self, *args):
         super(MaskedCCDBiasImageException, self).__init__(*args)
@@ -37,21 +60,38 @@ class MaskedCCD(dict):
     acceptance test scripts.  The pixel data for each segment is
     represented by a MaskedImageF object and are accessed via the
     amplifier number.  Masks can be added and manipulated separately
-    by various methods.
+    by various methods.  The input imfile can be a FITS filename, an
+    astropy.io.fits.HDUList, e.g., of simulated data held in memory,
+    or a sim_tools.CCD object, whose pixel arrays are copied directly.
     """
     def __init__(self, imfile, mask_files=(), bias_frame=None,
                  interpolateFromMasks=False, linearity_correction=None,
                  dark_frame=None, all_amps=None):
         super(MaskedCCD, self).__init__()
         self.imfile = imfile
-        self.md = imutils.Metadata(imfile)
-        self.amp_geom = makeAmplifierGeometry(imfile)
-        if all_amps is None:
-            all_amps = imutils.allAmps(imfile)
-        for amp in all_amps:
-            image = afwImage.ImageF(imfile, imutils.dm_hdu(amp))
-            mask = afwImage_Mask(image.getDimensions())
-            self[amp] = afwImage.MaskedImageF(image, mask)
+        if _is_sim_ccd(imfile):
+            # Use the pixel data, amplifier geometry, and primary
+            # header of the simulated CCD directly, without building
+            # the FITS HDUs.
+            primary_hdu = fits.PrimaryHDU(header=imfile.primary_header())
+            self.md = imutils.Metadata(fits.HDUList([primary_hdu]))
+            if all_amps is None:
+                all_amps = list(imfile.segments.keys())
+            self.amp_geom = next(iter(imfile.segments.values())).geometry
+            for amp in all_amps:
+                self._set_amp_image(
+                    amp, imfile.segments[amp].image.getArray().copy())
+        else:
+            self.md = imutils.Metadata(imfile)
+            if all_amps is None:
+                all_amps = imutils.allAmps(imfile)
+            # Read the amplifier geometry and the pixel data for all of
+            # the amps from a single open of the FITS file.
+            with _open_fits(imfile, memmap=True) as hdulist:
+                self.amp_geom = makeAmplifierGeometry(hdulist)
+                for amp in all_amps:
+                    self._set_amp_image(amp, np.array(hdulist[amp].data,
+                                                      dtype=np.float32))
         self._added_mask_types = []
         for mask_file in mask_files:
             self.add_masks(mask_file)
@@ -82,6 +122,12 @@ class MaskedCCD(dict):
         self._interpolateFromMasks = interpolateFromMasks
         self._linearity_correction = linearity_correction
 
+    def _set_amp_image(self, amp, imarr):
+        "Set the MaskedImageF for an amp from a float32 pixel array."
+        image = afwImage.ImageF(imarr)
+        mask = afwImage_Mask(image.getDimensions())
+        self[amp] = afwImage.MaskedImageF(image, mask)
+
     def applyInterpolateFromMask(self, maskedImage, fwhm=0.001):
         try:
             for maskName in self._added_mask_types:
@@ -105,9 +151,9 @@ class MaskedCCD(dict):
         """
         md = imutils.Metadata(mask_file)
         self._added_mask_types.append(md('MASKTYPE'))
+        mask_arrays = read_mask_arrays(mask_file, list(self.keys()))
         for amp in self:
-            curr_mask = self[amp].getMask()
-            curr_mask |= afwImage_Mask(mask_file, imutils.dm_hdu(amp))
+            self[amp].getMask().getArray()[:] |= mask_arrays[amp]
 
     def setMask(self, mask_name=None, clear=False):
         """
@@ -147,7 +193,7 @@ class MaskedCCD(dict):
             Flag to overwrite an existing output file.
         """
         hdulist = fits.HDUList()
-        with fits.open(self.imfile) as template:
+        with _open_fits(self.imfile) as template:
             hdulist.append(template[0])
             try:
                 hdulist[0].header['ORIGFILE'] = hdulist[0].header['FILENAME']
@@ -326,13 +372,59 @@ class MaskedCCD(dict):
         return mi
 
 
+def read_mask_arrays(mask_file, amps):
+    """
+    Read the mask pixel arrays for the specified amps from a single
+    open of a mask file.  As for afw's conformMaskPlanes, the mask
+    planes given by the MP_* keywords of each HDU are registered with
+    afw, their bits are moved to the current mask plane dict values,
+    and bits without an MP_* keyword are dropped.
+
+    Parameters
+    ----------
+    mask_file: str
+        Mask file, e.g., as written by generate_mask.
+    amps: list-like
+        Amplifiers to read.
+
+    Returns
+    -------
+    dict of numpy int32 arrays of mask pixel values, keyed by amp.
+    """
+    mask_arrays = dict()
+    with fits.open(mask_file) as hdulist:
+        for amp in amps:
+            hdu = hdulist[amp]
+            # Do the bit manipulations with unsigned ints so that bit
+            # 31 is handled correctly.
+            imarr = np.array(hdu.data, dtype=np.int32).view(np.uint32)
+            bits = [(bit, afwImage_Mask.addMaskPlane(key[len('MP_'):]))
+                    for key, bit in hdu.header.items()
+                    if key.startswith('MP_')]
+            if all(bit == new_bit for bit, new_bit in bits):
+                named_bits = np.uint32(sum(1 << bit for bit, _ in bits))
+                imarr &= named_bits
+            else:
+                new_arr = np.zeros_like(imarr)
+                for bit, new_bit in bits:
+                    new_arr |= ((imarr >> np.uint32(bit)) & np.uint32(1)) \
+                        << np.uint32(new_bit)
+                imarr = new_arr
+            mask_arrays[amp] = imarr.view(np.int32)
+    return mask_arrays
+
+
 def add_mask_files(mask_files, outfile, overwrite=True):
     amp_list = imutils.allAmps(mask_files[0])
-    masks = dict([(amp, afwImage_Mask(mask_files[0], imutils.dm_hdu(amp)))
-                  for amp in amp_list])
+    mask_arrays = read_mask_arrays(mask_files[0], amp_list)
     for mask_file in mask_files[1:]:
-        for amp in masks:
-            masks[amp] |= afwImage_Mask(mask_file, imutils.dm_hdu(amp))
+        for amp, imarr in read_mask_arrays(mask_file, amp_list).items():
+            mask_arrays[amp] |= imarr
+    masks = dict()
+    for amp, imarr in mask_arrays.items():
+        ny, nx = imarr.shape
+        masks[amp] = afwImage_Mask(nx, ny)
+        masks[amp].getArray()[:] = imarr
     output = fits.HDUList()
     output.append(fits.PrimaryHDU())
     output[0].header['MASKTYPE'] = 'SUMMED_MASKS'
@@ -57,26 +57,38 @@ def make_profile_hist(xbin_edges, xdata, ydata, **kwargs):
 
     nx = len(xbin_edges) - 1
     x_vals = (xbin_edges[0:-1] + xbin_edges[1:])/2.
-    y_vals = np.ndarray((nx))
-    y_errs = np.ndarray((nx))
 
     if yerrs is None:
         weights = np.ones(ydata.shape)
     else:
         weights = 1./(yerrs*yerrs)
 
-    y_w = ydata*weights
-
-    for i, (xmin, xmax) in enumerate(zip(xbin_edges[0:-1], xbin_edges[1:])):
-        mask = (xdata >= xmin) * (xdata < xmax)
-        if mask.sum() < 2:
-            y_vals[i] = 0.
-            y_errs[i] = -1.
-            continue
-        y_vals[i] = y_w[mask].sum() / weights[mask].sum()
-        y_errs[i] = ydata[mask].std()
-        if stderr:
-            y_errs[i] /= np.sqrt(mask.sum())
+    # Find the bin index of each point, keeping only the points within
+    # [xbin_edges[0], xbin_edges[-1]), then accumulate the per-bin sums
+    # in single passes over the data.
+    idx = np.digitize(xdata, xbin_edges) - 1
+    mask = (idx >= 0) & (idx < nx)
+    idx = idx[mask]
+    ydata = ydata[mask]
+    weights = weights[mask]
+
+    counts = np.bincount(idx, minlength=nx)
+    w_sum = np.bincount(idx, weights=weights, minlength=nx)
+    yw_sum = np.bincount(idx, weights=ydata*weights, minlength=nx)
+    y_sum = np.bincount(idx, weights=ydata, minlength=nx)
+
+    good = counts >= 2
+    y_vals = np.zeros(nx)
+    y_vals[good] = yw_sum[good]/w_sum[good]
+
+    # Unweighted rms about the unweighted mean in each bin.
+    y_mean = y_sum/np.where(good, counts, 1)
+    dy = ydata - y_mean[idx]
+    y_errs = np.sqrt(np.bincount(idx, weights=dy*dy, minlength=nx)
+                     /np.where(good, counts, 1))
+    if stderr:
+        y_errs /= np.sqrt(np.where(good, counts, 1))
+    y_errs[~good] = -1.
 
     return x_vals, y_vals, y_errs
 
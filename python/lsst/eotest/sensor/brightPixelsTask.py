@@ -8,6 +8,8 @@ bright column is specified via the --colthresh option.
 @author J. Chiang <jchiang@slac.stanford.edu>
 """
 import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
 import lsst.eotest.image_utils as imutils
 from .MaskedCCD import MaskedCCD
@@ -16,6 +18,7 @@ from .EOTestResults import EOTestResults
 from .generate_mask import generate_mask
 from .ccd_bias_pca import CCD_bias_PCA
 
+import lsst.afw.image as afwImage
 import lsst.pex.config as pexConfig
 import lsst.pipe.base as pipeBase
 
@@ -35,9 +38,16 @@ class BrightPixelsConfig(pexConfig.Config):
     output_dir = pexConfig.Field("Output directory", str, default=".")
     eotest_results_file = pexConfig.Field("EO test results filename",
                                           str, default=None)
+    nproc = pexConfig.Field("Number of processes to use for computing the median dark images",
+                            int, default=1)
     verbose = pexConfig.Field("Turn verbosity on", bool, default=True)
 
 
+def _median_image_array(dark_files, hdu):
+    "Compute the median image for an HDU and return the pixel array."
+    return imutils.fits_median(dark_files, hdu).getArray()
+
+
 class BrightPixelsTask(pipeBase.Task):
     """Task to find bright pixels and columns."""
     ConfigClass = BrightPixelsConfig
@@ -50,9 +60,22 @@ class BrightPixelsTask(pipeBase.Task):
                                    setpoint=self.config.temp_set_point,
                                    warn_only=True)
         median_images = {}
-        for amp in imutils.allAmps(dark_files[0]):
-            median_images[amp] = imutils.fits_median(dark_files,
-                                                     imutils.dm_hdu(amp))
+        amps = imutils.allAmps(dark_files[0])
+        if self.config.nproc > 1:
+            # The median images for each amp are independent, so
+            # compute them in parallel.
+            with ProcessPoolExecutor(max_workers=min(len(amps),
+                                                     self.config.nproc)) \
+                    as executor:
+                imarrs = executor.map(partial(_median_image_array,
+                                              dark_files),
+                                      [imutils.dm_hdu(amp) for amp in amps])
+                for amp, imarr in zip(amps, imarrs):
+                    median_images[amp] = afwImage.ImageF(imarr)
+        else:
+            for amp in amps:
+                median_images[amp] = imutils.fits_median(dark_files,
+                                                         imutils.dm_hdu(amp))
         medfile = os.path.join(self.config.output_dir,
                                '%s_median_dark_bp.fits' % sensor_id)
         if not isinstance(bias_frame, str):
@@ -4,9 +4,18 @@ jupyter notebook from Andrew Bradshaw.
 """
 import os
 import pickle
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 import numpy as np
 from astropy.io import fits
 from sklearn.decomposition import PCA
+try:
+    import numba
+    from numba import prange
+except ImportError:
+    numba = None
+    prange = range
 import lsst.afw.image as afwImage
 import lsst.afw.math as afwMath
 import lsst.afw.detection as afwDetect
@@ -19,8 +28,19 @@ from .AmplifierGeometry import makeAmplifierGeometry
 __all__ = ['CCD_bias_PCA', 'defect_repair', 'pca_superbias']
 
 
+def _pca_corrected_image(ccd_pcas, amp, bias_file, parallel=False):
+    """
+    Apply the PCA-based bias correction to an amp of a bias file,
+    returning an lsst.afw.image.ImageF object.
+    """
+    with fits.open(bias_file, memmap=True) as hdus:
+        imarr = np.array(hdus[amp].data, dtype=np.float32)
+    imarr -= ccd_pcas.pca_bias_correction(amp, imarr, parallel=parallel)
+    return afwImage.ImageF(imarr)
+
+
 def pca_superbias(bias_files, pca_bias_files, outfile, overwrite=True,
-                  statistic=afwMath.MEDIAN):
+                  statistic=afwMath.MEDIAN, nthreads=1):
     """
     Compute a "superbias" frame from a set of bias files with the
     PCA-biased correction applied to each image.
@@ -41,27 +61,206 @@ def pca_superbias(bias_files, pca_bias_files, outfile, overwrite=True,
     statistic: lsst.afw.math.statistics.Property [lsst.afw.math.MEDIAN]
         Statistic to use with lsst.afw.math.statisticsStack for producing
         the superbias frame.
+    nthreads: int [1]
+        Number of threads to use for applying the bias corrections to
+        the bias files.  If 1, numba's thread pool is used for the
+        defect-repair background models instead.
     """
     ccd_pcas = CCD_bias_PCA.read_model(*pca_bias_files)
-    if not hasattr(ccd_pcas, 'mean_amp_cache'):
-        ccd_pcas.mean_amp_cache = None
     amps = imutils.allAmps(bias_files[0])
+    if nthreads > 1:
+        # Read the mean bias images before launching the threads so
+        # that the cache is not modified concurrently.
+        ccd_pcas.cache_mean_amps(amps)
+        executor = ThreadPoolExecutor(max_workers=min(len(bias_files),
+                                                      nthreads))
+        map_func = executor.map
+    else:
+        executor = None
+        map_func = map
     medianed_images = dict()
-    for amp in amps:
-        images = []
-        for bias_file in bias_files:
-            imarr = np.array(fits.getdata(bias_file, amp), dtype=np.float32)
-            imarr -= ccd_pcas.pca_bias_correction(amp, imarr)
-            images.append(afwImage.ImageF(imarr))
-        medianed_images[amp] = afwMath.statisticsStack(images, statistic)
-    with fits.open(bias_files[0]) as hdus:
+    try:
+        for amp in amps:
+            # Correct and stack the images one amp at a time so that
+            # only a single amp's images are held in memory.
+            images = list(map_func(partial(_pca_corrected_image,
+                                           ccd_pcas, amp,
+                                           parallel=(nthreads == 1)),
+                                   bias_files))
+            medianed_images[amp] = afwMath.statisticsStack(images, statistic)
+            del images
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    # Use the first bias file as a template for the output.  Its pixel
+    # data are memory-mapped and replaced before being accessed, so
+    # only the headers are read.
+    with fits.open(bias_files[0], memmap=True) as hdus:
         for amp, image in medianed_images.items():
             hdus[amp].data = image.array
         hdus[0].header['FILENAME'] = os.path.basename(outfile)
         fitsWriteto(hdus, outfile, overwrite=overwrite)
 
 
-def defect_repair(imarr, sigma=10, nx=10, ny=10, grow=2, use_abs_image=False):
+def _block_medians_loop(arr, yedges, xedges, out):
+    """
+    Compute the median pixel value in each block of the grid defined
+    by yedges and xedges.  Loop version for compilation with numba.
+    """
+    for j in prange(len(yedges) - 1):
+        for i in range(len(xedges) - 1):
+            out[j, i] = np.median(arr[yedges[j]:yedges[j + 1],
+                                      xedges[i]:xedges[i + 1]])
+
+
+def _block_medians_numpy(arr, yedges, xedges, out):
+    """
+    Compute the median pixel value in each block of the grid defined
+    by yedges and xedges.  The blocks are gathered by size, so that
+    there is one np.median call for each distinct block shape.
+    """
+    heights = np.diff(yedges)
+    widths = np.diff(xedges)
+    for height in np.unique(heights):
+        jj = np.nonzero(heights == height)[0]
+        rows = yedges[jj][:, None] + np.arange(height)
+        for width in np.unique(widths):
+            ii = np.nonzero(widths == width)[0]
+            cols = xedges[ii][:, None] + np.arange(width)
+            blocks = arr[rows[:, None, :, None], cols[None, :, None, :]]
+            out[np.ix_(jj, ii)] = np.median(
+                blocks.reshape(len(jj), len(ii), -1), axis=2)
+
+
+if numba is not None:
+    _block_medians_parallel \
+        = numba.njit(parallel=True, cache=True)(_block_medians_loop)
+else:
+    _block_medians_parallel = None
+
+
+def _interp_indices(edges):
+    """
+    Indices and weights for linear interpolation from the centers of
+    the blocks defined by edges to each pixel.
+    """
+    centers = (edges[:-1] + edges[1:] - 1)/2.
+    index = np.interp(np.arange(edges[-1]), centers, np.arange(len(centers)))
+    i0 = index.astype(int)
+    i1 = np.minimum(i0 + 1, len(centers) - 1)
+    return i0, i1, index - i0
+
+
+def _background_grid(shape, nbins_x, nbins_y):
+    """
+    Block edges and interpolation indices and weights for the local
+    background model of an array with the given shape.
+    """
+    ny, nx = shape
+    yedges = np.linspace(0, ny, min(nbins_y, ny) + 1).astype(int)
+    xedges = np.linspace(0, nx, min(nbins_x, nx) + 1).astype(int)
+    return yedges, xedges, _interp_indices(yedges), _interp_indices(xedges)
+
+
+def _block_background(arr, grid, parallel=False):
+    """
+    Local background model using the medians of the blocks of the
+    grid from `_background_grid`, bilinearly interpolated between the
+    block centers.  If parallel is True and numba is available, the
+    block medians are computed with numba's thread pool.  This should
+    only be done by callers that are not themselves running in a
+    process or thread pool, since the numba thread pool is started
+    in each process, and its default threading layer does not support
+    concurrent launches from several threads.
+    """
+    yedges, xedges, (iy0, iy1, wy), (ix0, ix1, wx) = grid
+    medians = np.empty((len(yedges) - 1, len(xedges) - 1))
+    if parallel and _block_medians_parallel is not None:
+        _block_medians_parallel(arr, yedges, xedges, medians)
+    else:
+        _block_medians_numpy(arr, yedges, xedges, medians)
+    rows = (medians[iy0]*(1. - wy)[:, None] + medians[iy1]*wy[:, None])
+    return rows[:, ix0]*(1. - wx) + rows[:, ix1]*wx
+
+
+class _DefectRepairer:
+    """
+    Pixel defect repair as done by `defect_repair`.  The background
+    grid and the afw image and mask buffers are created once for each
+    array shape and reused in subsequent calls.  The buffers are kept
+    per thread.
+    """
+    def __init__(self, sigma=10, nx=10, ny=10, grow=2, use_abs_image=False):
+        self.sigma = sigma
+        self.nx = nx
+        self.ny = ny
+        self.grow = grow
+        self.use_abs_image = use_abs_image
+        self._local = threading.local()
+
+    def _get_scratch(self, shape):
+        if not hasattr(self._local, 'scratch'):
+            self._local.scratch = dict()
+        if shape not in self._local.scratch:
+            nbins_x = max(10, shape[1]//self.nx)
+            nbins_y = max(10, shape[0]//self.ny)
+            grid = _background_grid(shape, nbins_x, nbins_y)
+            image = afwImage.ImageF(shape[1], shape[0])
+            abs_image = (afwImage.ImageF(shape[1], shape[0])
+                         if self.use_abs_image else image)
+            mi = afwImage.MaskedImageF(shape[1], shape[0])
+            self._local.scratch[shape] = grid, image, abs_image, mi
+        return self._local.scratch[shape]
+
+    def repair(self, imarr, parallel=False):
+        """
+        Repair the pixel defects in imarr, returning a
+        numpy.ma.MaskedArray.  See `_block_background` for the
+        parallel option.
+        """
+        grid, image, abs_image, mi = self._get_scratch(imarr.shape)
+
+        # Do local background modeling and subtraction.
+        image.array[:] = imarr
+        image.array -= _block_background(image.array, grid,
+                                         parallel=parallel)
+
+        # Compute the detection threshold using the clipped stdev.
+        stats = afwMath.makeStatistics(image, afwMath.STDEVCLIP)
+        stdev = stats.getValue(afwMath.STDEVCLIP)
+        threshold = afwDetect.Threshold(self.sigma*stdev)
+
+        # Take the absolute value of image array to detect outlier pixels
+        # with both positive and negative values.
+        if self.use_abs_image:
+            np.abs(image.array, out=abs_image.array)
+
+        # Generate footprints for the above-threshold pixels and grow them
+        # by `grow` pixels.
+        fpset = afwDetect.FootprintSet(abs_image, threshold)
+        fpset = afwDetect.FootprintSet(fpset, self.grow, False)
+
+        # Clear the mask and set the bad pixels.
+        mask = mi.getMask()
+        mask.array[:] = 0
+        mask_name = 'BAD'
+        fpset.setMask(mask, mask_name)
+
+        # Interpolate over the bad pixels in the original data.
+        mi.getImage().array[:] = imarr
+        fwhm = 1
+        out_image = ipIsr.interpolateFromMask(mi, fwhm,
+                                              maskNameList=[mask_name])\
+                         .getImage()
+
+        # Convert to a numpy.ma.MaskedArray, copying the data out of the
+        # scratch buffers, and return.
+        return np.ma.MaskedArray(data=out_image.array.copy(),
+                                 mask=(mask.array == 1))
+
+
+def defect_repair(imarr, sigma=10, nx=10, ny=10, grow=2, use_abs_image=False,
+                  parallel=False):
     """Repair pixel defects in an array of pixel data.
 
     Parameters
@@ -79,6 +278,10 @@ def defect_repair(imarr, sigma=10, nx=10, ny=10, grow=2, use_abs_image=False):
     use_abs_image: bool [False]
         Take the absolute value of the background-subtracted image to
         find positive and negative defects.
+    parallel: bool [False]
+        Compute the local background model using numba's thread pool,
+        if numba is available.  This should not be set by callers
+        running in a process or thread pool.
 
     Returns
     -------
@@ -86,8 +289,8 @@ def defect_repair(imarr, sigma=10, nx=10, ny=10, grow=2, use_abs_image=False):
 
     Algorithm
     ---------
-    * A local background model, based on pixel neighborhoods of size nx x ny,
-      is subtracted from the raw data.
+    * A local background model, based on the medians of pixel
+      neighborhoods of size nx x ny, is subtracted from the raw data.
     * A clipped stdev is computed from the background-subtracted data, and
       a threshold of sigma*clipped_stdev is computed.
     * Defect footprints are found by applying that threshold to the `np.abs`
@@ -97,49 +300,31 @@ def defect_repair(imarr, sigma=10, nx=10, ny=10, grow=2, use_abs_image=False):
     * A "BAD" pixel mask is created from the grown footprints.
     * The original image data is interpolated across the masked regions.
     """
-    # Create an lsst.afw.image.ImageF object so that the afw tools
-    # can be used.
-    image = afwImage.ImageF(np.array(imarr, dtype=np.float32))
-
-    # Do local background modeling and subtraction.
-    nbins_x = max(10, imarr.shape[1]//nx)
-    nbins_y = max(10, imarr.shape[0]//ny)
-    bg_ctrl = afwMath.BackgroundControl(nbins_x, nbins_y)
-    image -= afwMath.makeBackground(image, bg_ctrl).getImageF()
-
-    # Compute the detection threshold using the clipped stdev.
-    stats = afwMath.makeStatistics(image, afwMath.STDEVCLIP)
-    stdev = stats.getValue(afwMath.STDEVCLIP)
-    threshold = afwDetect.Threshold(sigma*stdev)
-
-    # Take the absolute value of image array to detect outlier pixels
-    # with both positive and negative values.
-    abs_image = image.Factory(image, deep=True)
-    if use_abs_image:
-        abs_image.array = np.abs(image.array)
-
-    # Generate footprints for the above-threshold pixels and grow them
-    # by `grow` pixels.
-    fpset = afwDetect.FootprintSet(abs_image, threshold)
-    fpset = afwDetect.FootprintSet(fpset, grow, False)
-
-    # Make a mask and set the bad pixels.
-    mask = afwImage.Mask(image.getDimensions())
-    mask_name = 'BAD'
-    fpset.setMask(mask, mask_name)
-
-    # Create a MaskedImage from the original data.
-    mi = afwImage.MaskedImageF(
-        afwImage.ImageF(np.array(imarr, dtype=np.float32)), mask)
-    fwhm = 1
-    out_image = ipIsr.interpolateFromMask(mi, fwhm, maskNameList=[mask_name])\
-                     .getImage()
-
-    # Convert to a numpy.ma.MaskedArray and return
-    return np.ma.MaskedArray(data=out_image.array, mask=(mask.array == 1))
-
-
-def get_amp_stack(fits_files, amp, sigma=10, nx=10, ny=10, grow=2):
+    return _DefectRepairer(sigma=sigma, nx=nx, ny=ny, grow=grow,
+                           use_abs_image=use_abs_image).repair(
+                               imarr, parallel=parallel)
+
+
+# Defect repairer used for the overscan regions in
+# CCD_bias_PCA.pca_bias_correction.
+_overscan_repairer = _DefectRepairer()
+
+
+def _median_axis0(stack):
+    """
+    Median of a stack of images along the first axis, using
+    np.partition rather than a full sort.
+    """
+    nimages = stack.shape[0]
+    k = nimages//2
+    if nimages % 2 == 1:
+        return np.partition(stack, k, axis=0)[k]
+    partitioned = np.partition(stack, (k - 1, k), axis=0)
+    return (partitioned[k - 1] + partitioned[k])/2
+
+
+def get_amp_stack(fits_files, amp, sigma=10, nx=10, ny=10, grow=2,
+                  parallel=False):
     """Get a list of numpy arrays of pixel data for the specified amp.
 
     Parameters
@@ -159,21 +344,49 @@ def get_amp_stack(fits_files, amp, sigma=10, nx=10, ny=10, grow=2):
     grow: int [2]
         Number of pixels to grow the above-threshold footprints
         for mask generation.
+    parallel: bool [False]
+        Compute the local background models for the defect repair
+        using numba's thread pool, if numba is available.
 
     Returns
     -------
     numpy array of a stack of amp imaging section pixel data
     """
-    amp_stack = []
-    for item in fits_files:
+    if sigma is not None:
+        repairer = _DefectRepairer(sigma=sigma, nx=nx, ny=ny, grow=grow)
+    amp_stack = None
+    for i, item in enumerate(fits_files):
         with fits.open(item) as hdus:
             if sigma is None:
                 imarr = hdus[amp].data
             else:
-                imarr = defect_repair(hdus[amp].data, sigma=sigma,
-                                      nx=nx, ny=ny, grow=grow)
-            amp_stack.append(np.array(imarr, dtype=float))
-    return np.array(amp_stack)
+                imarr = repairer.repair(hdus[amp].data,
+                                        parallel=parallel).data
+            if amp_stack is None:
+                amp_stack = np.empty((len(fits_files),) + imarr.shape,
+                                     dtype=np.float32)
+            amp_stack[i] = imarr
+    return amp_stack
+
+
+def _fit_one_amp(ccd_pcas, fits_files, amp, sigma=10, grow=2,
+                 fit_full_segment=True, verbose=False, use_median=True,
+                 parallel=False):
+    """
+    Compute the serial and parallel PCA models and the mean bias image
+    for a single amp.  This is a module-level function so that it can
+    be run in a process pool, in which case parallel should be False.
+    """
+    if verbose:
+        print(f"amp {amp}")
+    amp_stack = get_amp_stack(fits_files, amp, sigma=sigma,
+                              nx=ccd_pcas.nx, ny=ccd_pcas.ny, grow=grow,
+                              parallel=parallel)
+    pcax, pcay, mean_amp \
+        = ccd_pcas._compute_amp_pcas(amp_stack,
+                                     fit_full_segment=fit_full_segment,
+                                     verbose=verbose, use_median=use_median)
+    return amp, pcax, pcay, mean_amp
 
 
 class CCD_bias_PCA(dict):
@@ -215,11 +428,11 @@ class CCD_bias_PCA(dict):
         self.x_oscan_corner = None
         self.y_oscan_corner = None
         self.pca_bias_file = None
-        self.mean_amp_cache = None
+        self.mean_amp_cache = dict()
 
     def compute_pcas(self, fits_files, outfile_prefix, amps=None,
                      verbose=False, fit_full_segment=True, sigma=10,
-                     grow=2, use_median=True):
+                     grow=2, use_median=True, nproc=1):
         """
         Compute mean bias and PCA models of serial and parallel
         overscans using a list of bias frame FITS files for a
@@ -249,6 +462,10 @@ class CCD_bias_PCA(dict):
         use_median: bool [True]
             Compute the median of the stacked images for the mean_amp
             image.  If False, then compute the mean.
+        nproc: int [1]
+            Number of processes to use for computing the models for
+            the different amps.  If 1, numba's thread pool is used for
+            the defect-repair background models instead.
         """
         amp_geom = makeAmplifierGeometry(fits_files[0])
         self.x_oscan_corner = amp_geom.imaging.getEndX()
@@ -257,20 +474,24 @@ class CCD_bias_PCA(dict):
             self.xstart = amp_geom.imaging.getBeginX()
         if amps is None:
             amps = imutils.allAmps(fits_files[0])
+        fit_one_amp = partial(_fit_one_amp, self, fits_files, sigma=sigma,
+                              grow=grow, fit_full_segment=fit_full_segment,
+                              verbose=verbose, use_median=use_median,
+                              parallel=(nproc == 1))
+        if nproc > 1:
+            # The models for each amp are independent, so compute
+            # them in parallel.
+            with ProcessPoolExecutor(max_workers=min(len(amps), nproc)) \
+                    as executor:
+                results = list(executor.map(fit_one_amp, amps))
+        else:
+            results = [fit_one_amp(amp) for amp in amps]
         with fits.open(fits_files[0]) as mean_bias_frame:
-            for amp in amps:
-                if verbose:
-                    print(f"amp {amp}")
-                amp_stack = get_amp_stack(fits_files, amp, sigma=sigma,
-                                          nx=self.nx, ny=self.ny, grow=grow)
-                pcax, pcay, mean_amp \
-                    = self._compute_amp_pcas(amp_stack,
-                                             fit_full_segment=fit_full_segment,
-                                             verbose=verbose,
-                                             use_median=use_median)
+            for amp, pcax, pcay, mean_amp in results:
                 self[amp] = pcax, pcay
                 mean_bias_frame[amp].data = mean_amp
             self.pca_bias_file = f'{outfile_prefix}_pca_bias.fits'
+            self.mean_amp_cache = dict()
             mean_bias_frame[0].header['FILENAME'] = self.pca_bias_file
             fitsWriteto(mean_bias_frame, self.pca_bias_file, overwrite=True)
         pickle_file = f'{outfile_prefix}_pca_bias.pickle'
@@ -281,7 +502,7 @@ class CCD_bias_PCA(dict):
                           verbose=False, use_median=True):
         # Compute the me[di]an bias image from the stack of amp data.
         if use_median:
-            mean_amp = np.median(amp_stack, axis=0)
+            mean_amp = _median_axis0(amp_stack)
         else:
             mean_amp = np.mean(amp_stack, axis=0)
         if verbose:
@@ -291,22 +512,22 @@ class CCD_bias_PCA(dict):
         # stack of raw amplifier data.  Also subtract the me[di]an of the
         # per-amp overscan corner from each image, and apply a noise
         # cut of self.std_max for inclusion in the training set.
-        imarrs = []
-        stdevs = []
-        for i, _ in enumerate(amp_stack):
-            imarr = _.copy()
-            imarr -= mean_amp
-            imarr -= self.mean_oscan_corner(imarr)
-            stdevs.append(np.std(imarr))
-            imarrs.append(imarr)
+        centered = amp_stack - mean_amp
+        corner_means = centered[:, self.y_oscan_corner:,
+                                self.x_oscan_corner:].mean(axis=(1, 2))
+        centered -= corner_means[:, None, None]
+        stdevs = np.array([np.std(imarr) for imarr in centered])
         std_max = max(self.std_max, np.percentile(stdevs, 80))
-        training_set = []
-        for i, (stdev, imarr) in enumerate(zip(stdevs, imarrs)):
-            if stdev <= std_max:
-                training_set.append(imarr)
-            else:
-                print('_compute_amp_pcas: rejected frame:',
-                      i, stdev, std_max)
+        for i in np.where(stdevs > std_max)[0]:
+            print('_compute_amp_pcas: rejected frame:',
+                  i, stdevs[i], std_max)
+        # Move the accepted frames to the front of the centered stack,
+        # rather than copying them into a new array.
+        keep = np.where(stdevs <= std_max)[0]
+        for j, i in enumerate(keep):
+            if i != j:
+                centered[j] = centered[i]
+        training_set = centered[:len(keep)]
 
         if verbose:
             print("training set size:", len(training_set))
@@ -315,42 +536,45 @@ class CCD_bias_PCA(dict):
         if fit_full_segment:
             # This uses the full data segment, rather than just the parallel
             # overscan.
-            x_profs = [np.mean(_, axis=0)[self.xstart:] for _ in training_set]
+            x_profs = np.mean(training_set[:, :, self.xstart:], axis=1)
         else:
             # Use the parallel overscan region instead of full
             # segment.
-            x_profs = [np.mean(_[self.y_oscan_corner:, :], axis=0)[self.xstart:]
-                       for _ in training_set]
+            x_profs = np.mean(training_set[:, self.y_oscan_corner:,
+                                           self.xstart:], axis=1)
 
-        # Run the PCA fit for the serial direction
-        pcax = PCA(self.ncomp_x)
+        # Run the PCA fit for the serial direction.  Only the leading
+        # ncomp_x components are needed, so use the randomized SVD solver
+        # rather than a full SVD.
+        pcax = PCA(self.ncomp_x, svd_solver='randomized', random_state=0)
         pcax.fit(x_profs)
 
         # Use the previous serial direction decomposition to do the
-        # fitting in the parallel direction.
-        y_profs = []
-        for imarr in training_set:
+        # fitting in the parallel direction.  The training images are
+        # projected one at a time so that no temporaries the size of
+        # the full stack are created.
+        cropped = training_set[:, self.ystart:, self.xstart:]
+        y_profs = np.empty(cropped.shape[:2])
+        for i, imarr in enumerate(cropped):
             # Build the serial model, using the pcax basis set, and fit
             # to the full segment data in the serial direction.
-            _ = pcax.transform(imarr[self.ystart:, self.xstart:])
-            proj = pcax.inverse_transform(_)
-            serial_model = np.mean(proj, axis=0)
+            _ = pcax.transform(imarr)
+            serial_model = np.mean(pcax.inverse_transform(_), axis=0)
 
-            # Subtract the serial model from the me[di]an-subtracted training
-            # image.
-            new_imarr = imarr.copy()[self.ystart:, self.xstart:] - serial_model
+            # Subtract the serial model from the me[di]an-subtracted
+            # training image.
+            new_imarr = imarr - serial_model
 
-            # Add the resulting profile to the y-ensemble
+            # Compute the profile for the y-ensemble.
             if fit_full_segment:
-                y_profs.append(np.mean(new_imarr, axis=1))
+                y_profs[i] = np.mean(new_imarr, axis=1)
             else:
                 # Just use the serial overscan data.
-                y_profs.append(np.mean(new_imarr[:, self.x_oscan_corner:],
-                                       axis=1))
-
+                y_profs[i] = np.mean(new_imarr[:, self.x_oscan_corner:],
+                                     axis=1)
 
         # Run the PCA fit for the parallel direction.
-        pcay = PCA(self.ncomp_y)
+        pcay = PCA(self.ncomp_y, svd_solver='randomized', random_state=0)
         pcay.fit(y_profs)
 
         return pcax, pcay, mean_amp
@@ -426,9 +650,26 @@ class CCD_bias_PCA(dict):
         """
         my_instance = CCD_bias_PCA.read_pickle(pca_model_file)
         my_instance.pca_bias_file = pca_bias_file
+        my_instance.mean_amp_cache = dict()
         return my_instance
 
-    def pca_bias_correction(self, amp, image_array):
+    def cache_mean_amps(self, amps):
+        """
+        Read the mean bias images for the specified amps from the PCA
+        bias file into the mean_amp_cache.
+
+        Parameters
+        ----------
+        amps: list-like
+            Amplifiers for which to read the mean bias images.
+        """
+        with fits.open(self.pca_bias_file, memmap=True) as hdus:
+            for amp in amps:
+                if amp not in self.mean_amp_cache:
+                    self.mean_amp_cache[amp] \
+                        = hdus[amp].data.astype(np.float32)
+
+    def pca_bias_correction(self, amp, image_array, parallel=False):
         """
         Compute the bias model based on the PCA fit.  This should be
         subtracted from the raw data for the specified amp in order to
@@ -441,6 +682,11 @@ class CCD_bias_PCA(dict):
         image_array: numpy.array
             Array containing the pixel values for the full segment of
             the specified amp.
+        parallel: bool [False]
+            Compute the local background models for the overscan defect
+            repair using numba's thread pool, if numba is available.
+            This should not be set by callers running in a process or
+            thread pool.
 
         Returns
         -------
@@ -449,12 +695,11 @@ class CCD_bias_PCA(dict):
 
         """
         pcax, pcay = self[amp]
-        if self.mean_amp_cache is None or self.mean_amp_cache[0] != amp:
-            mean_amp = fits.getdata(self.pca_bias_file, amp).astype('float')
-            self.mean_amp_cache = (amp, mean_amp)
-        else:
-            mean_amp = self.mean_amp_cache[1]
+        if amp not in self.mean_amp_cache:
+            self.cache_mean_amps([amp])
+        mean_amp = self.mean_amp_cache[amp]
 
+        image_array = image_array.astype(np.float32, copy=False)
         imarr = image_array - mean_amp
 
         # Run defect repair on overscan regions.
@@ -462,11 +707,13 @@ class CCD_bias_PCA(dict):
 
         # Parallel overscan region:
         yslice = slice(self.y_oscan_corner, ny)
-        imarr[yslice, :] = defect_repair(imarr[yslice, :]).data
+        imarr[yslice, :] = _overscan_repairer.repair(imarr[yslice, :],
+                                                     parallel=parallel).data
 
         # Serial overscan region:
         xslice = slice(self.x_oscan_corner, nx)
-        imarr[:, xslice] = defect_repair(imarr[:, xslice]).data
+        imarr[:, xslice] = _overscan_repairer.repair(imarr[:, xslice],
+                                                     parallel=parallel).data
 
         corner_mean = self.mean_oscan_corner(imarr)
         imarr -= corner_mean
@@ -485,8 +732,9 @@ class CCD_bias_PCA(dict):
 
         bias_model = mean_amp + corner_mean
         bias_model[self.ystart:, self.xstart:] += serial_model
-        bias_model = (bias_model.T + parallel_model).T
-        bias_model += self.mean_oscan_corner(image_array - bias_model)
+        bias_model += parallel_model[:, None]
+        bias_model += (self.mean_oscan_corner(image_array)
+                       - self.mean_oscan_corner(bias_model))
 
         return bias_model
 
@@ -520,14 +768,19 @@ class CCD_bias_PCA(dict):
         """
         if amps is None:
             amps = imutils.allAmps(raw_file)
+        bias_models = dict()
         with fits.open(raw_file) as hdus:
             for amp in amps:
-                hdus[amp].data = self.pca_bias_correction(amp, hdus[amp].data)
+                bias_models[amp] = self.pca_bias_correction(amp,
+                                                            hdus[amp].data)
+                hdus[amp].data = bias_models[amp]
             fitsWriteto(hdus, outfile, overwrite=True)
 
         if residuals_file is not None:
-            with fits.open(raw_file) as resids, fits.open(outfile) as bias:
+            # Use the bias models computed above rather than reading
+            # them back from outfile.
+            with fits.open(raw_file) as resids:
                 for amp in amps:
                     resids[amp].data = (np.array(resids[amp].data, dtype=float)
-                                        - bias[amp].data)
+                                        - bias_models[amp])
                 resids.writeto(residuals_file, overwrite=True)
@@ -8,6 +8,8 @@ from __future__ import absolute_import
 import os
 import time
 import copy
+import multiprocessing
+from functools import partial
 import numpy as np
 import astropy.io.fits as fits
 from lsst.eotest.fitsTools import fitsWriteto
@@ -132,15 +134,9 @@ def extract_mean_signal(ccd, amp, footprint):
     stdev = afwMath.makeStatistics(image, afwMath.STDEVCLIP,
                                    ccd.stat_ctrl).getValue()
     imarr = image.getImage().getArray()
-    signal = 0
-    npix = 0
-    for span in footprint.getSpans():
-        y = span.getY()
-        for x in range(span.getX0(), span.getX1()+1):
-            npix += 1
-            if maskarr[y][x] == 0:
-                signal += imarr[y][x]
-    return np.array((signal/float(npix), stdev))
+    xs, ys = imutils.footprint_pixels(footprint)
+    signal = np.sum(imarr[ys, xs][maskarr[ys, xs] == 0])
+    return np.array((signal/float(len(xs)), stdev))
 
 
 def detector_crosstalk(ccd, aggressor_amp, dnthresh=None, nsig=5,
@@ -170,9 +166,10 @@ def detector_crosstalk(ccd, aggressor_amp, dnthresh=None, nsig=5,
     except IndexError:
         raise RuntimeError('index error in get_footprint')
 
-    agg_mean = signal_extractor(ccd, aggressor_amp, footprint)[0]
-    ratios = dict([(amp, signal_extractor(ccd, amp, footprint)
-                    / agg_mean) for amp in ccd])
+    signals = dict([(amp, signal_extractor(ccd, amp, footprint))
+                    for amp in ccd])
+    agg_mean = signals[aggressor_amp][0]
+    ratios = dict([(amp, signals[amp]/agg_mean) for amp in ccd])
 #    for amp in ratios:
 #        if ratios[amp][0] > 0.1:
 #            ratios[amp] = (0, 0)
@@ -197,9 +194,16 @@ class CrosstalkMatrix(object):
     def _read_matrix(self):
         if self.filename[-5:] == '.fits':
             self._read_fits_matrix()
+        elif self.filename[-4:] == '.npz':
+            self._read_npz_matrix()
         else:
             self._read_text_matrix()
 
+    def _read_npz_matrix(self):
+        with np.load(self.filename) as data:
+            self.matrix = data['matrix']
+        self.namps = self.matrix.shape[0]
+
     def _read_fits_matrix(self):
         with fits.open(self.filename) as fd:
             self.matrix = copy.deepcopy(fd[0].data)
@@ -223,6 +227,19 @@ class CrosstalkMatrix(object):
         output.append(fits.PrimaryHDU(data=self.matrix))
         fitsWriteto(output, outfile, overwrite=overwrite)
 
+    def write_npz(self, outfile=None):
+        """
+        Write the matrix as a binary numpy .npz file, which is much
+        faster to read back than the text format.  The .npz suffix is
+        appended to outfile if it is missing, as np.savez would do.
+        """
+        if outfile is None:
+            outfile = self.filename
+        if not outfile.endswith('.npz'):
+            outfile += '.npz'
+        self.filename = outfile
+        np.savez(outfile, matrix=self.matrix)
+
     def write(self, outfile=None):
         if outfile is None:
             outfile = self.filename
@@ -304,13 +321,62 @@ class CrosstalkMatrix(object):
         return result
 
 
+def _frame_name(ccd):
+    """
+    Name of the frame of a MaskedCCD for printing, using the FILENAME
+    keyword of the primary header for in-memory frames.
+    """
+    if isinstance(ccd.imfile, (str, bytes, os.PathLike)):
+        return ccd.imfile
+    try:
+        filename = ccd.md.get('FILENAME')
+    except KeyError:
+        filename = None
+    return filename or 'in-memory frame'
+
+
+def _single_aggressor_ratios(infile, mask_files=(),
+                             extractor=detector_crosstalk, verbose=True):
+    """
+    Compute the victim/aggressor ratios for a frame with a single
+    aggressor amp.  The frame can be given as a filename, an HDUList
+    or a MaskedCCD object.  Returns the aggressor amp and the ratios,
+    or None for the ratios if the extraction fails.
+    """
+    if isinstance(infile, MaskedCCD):
+        ccd = infile
+    else:
+        ccd = MaskedCCD(infile, mask_files=mask_files)
+    if verbose:
+        print("processing", _frame_name(ccd))
+    agg_amp, max_dn = aggressor(ccd)
+    try:
+        return agg_amp, extractor(ccd, agg_amp)
+    except RuntimeError as message:
+        print("Error extracting victim/aggressor ratios:")
+        print(message)
+        print("Skipping.")
+        return agg_amp, None
+
+
 def make_crosstalk_matrix(file_list, mask_files=(),
-                          extractor=detector_crosstalk, verbose=True):
+                          extractor=detector_crosstalk, verbose=True,
+                          nproc=1):
+    """
+    Compute the crosstalk matrix from a single multi-aggressor spot
+    frame or from a sequence of single-aggressor frames.  Frames can be
+    given as filenames, HDULists or MaskedCCD objects; mask_files are
+    only applied to frames that are not already MaskedCCD objects.
+    """
     det_xtalk = CrosstalkMatrix()
-    try:
-        os.path.isfile(file_list)
-        # A single file, so we assume that we have a multi-aggressor spot frame.
-        ccd = MaskedCCD(file_list, mask_files=mask_files)
+    if isinstance(file_list, (str, bytes, os.PathLike, fits.HDUList,
+                              MaskedCCD)):
+        # A single frame, so we assume that we have a multi-aggressor
+        # spot frame.
+        if isinstance(file_list, MaskedCCD):
+            ccd = file_list
+        else:
+            ccd = MaskedCCD(file_list, mask_files=mask_files)
         for agg_amp in ccd:
             if verbose:
                 print("processing aggressor amp", agg_amp)
@@ -321,20 +387,19 @@ def make_crosstalk_matrix(file_list, mask_files=(),
                 print("Error extracting victim/aggressor ratios.")
                 print(message)
                 print("Skipping.")
-    except TypeError:
-        # Presumably, we have a 16 amplifier dataset.
-        for infile in file_list:
-            if verbose:
-                print("processing", infile)
-            ccd = MaskedCCD(infile, mask_files=mask_files)
-            agg_amp, max_dn = aggressor(ccd)
-            try:
-                ratios = extractor(ccd, agg_amp)
+    else:
+        # Presumably, we have a 16 amplifier dataset.  The frames
+        # are independent, so optionally process them in parallel.
+        func = partial(_single_aggressor_ratios, mask_files=mask_files,
+                       extractor=extractor, verbose=verbose)
+        if nproc > 1:
+            with multiprocessing.Pool(processes=nproc) as pool:
+                results = pool.map(func, file_list)
+        else:
+            results = [func(infile) for infile in file_list]
+        for agg_amp, ratios in results:
+            if ratios is not None:
                 det_xtalk.set_row(agg_amp, ratios)
-            except RuntimeError as message:
-                print("Error extracting victim/aggressor ratios:")
-                print(message)
-                print("Skipping.")
     return det_xtalk
 
 
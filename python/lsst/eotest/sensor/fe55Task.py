@@ -36,6 +36,8 @@ class Fe55Config(pexConfig.Config):
                                           str, default=None)
     fit_xy = pexConfig.Field("Fit sigmas in x- and y-directions separately",
                              bool, default=False)
+    nproc = pexConfig.Field("Number of processes to use for the cluster fits",
+                            int, default=1)
     verbose = pexConfig.Field("Turn verbosity on", bool, default=True)
 
 
@@ -93,7 +95,8 @@ class Fe55Task(pipeBase.Task):
         # Detect and fit 2D Gaussian to Fe55 charge clusters,
         # accumulating the results by amplifier.
         #
-        fitter = PsfGaussFit(nsig=self.config.nsig, fit_xy=self.config.fit_xy)
+        fitter = PsfGaussFit(nsig=self.config.nsig, fit_xy=self.config.fit_xy,
+                             nproc=self.config.nproc)
         gains, gain_errors, sigma_modes = {}, {}, {}
         if fe55_catalog is None:
             for infile in infiles:
@@ -125,6 +128,7 @@ class Fe55Task(pipeBase.Task):
                         self.fit_gains(fitter, gains, gain_errors, sigma_modes,
                                        amps=[amp], hist_nsig=hist_nsig,
                                        dn_range=dn_range)
+            fitter.close()
             if self.config.output_file is None:
                 psf_results = os.path.join(self.config.output_dir,
                                            '%s_psf_results_nsig%i.fits'
@@ -7,6 +7,8 @@ compute the probability of the chi-square fit.
 """
 from __future__ import print_function
 from __future__ import absolute_import
+import math
+import multiprocessing
 import numpy as np
 import warnings
 import itertools
@@ -14,6 +16,10 @@ import astropy.io.fits as fits
 from lsst.eotest.fitsTools import fitsTableFactory, fitsWriteto
 import scipy.optimize
 from scipy.special import erf, gammaincc
+try:
+    import numba
+except ImportError:
+    numba = None
 
 import lsst.afw.detection as afwDetect
 import lsst.afw.image as afwImage
@@ -25,6 +31,52 @@ from .MaskedCCD import MaskedCCD, MaskedCCDBiasImageException
 import pdb
 
 _sqrt2 = np.sqrt(2)
+_sqrtpi = np.sqrt(np.pi)
+
+
+def _psf_kernel(x, y, x0, y0, sigmax, sigmay, DN_tot, out):
+    """
+    Single-pass loop version of psf_func for compilation with numba.
+    """
+    sqrt2sigmax = _sqrt2*sigmax
+    sqrt2sigmay = _sqrt2*sigmay
+    for i in range(x.shape[0]):
+        Fx = (math.erf((x[i] + 0.5 - x0)/sqrt2sigmax)
+              - math.erf((x[i] - 0.5 - x0)/sqrt2sigmax))
+        Fy = (math.erf((y[i] + 0.5 - y0)/sqrt2sigmay)
+              - math.erf((y[i] - 0.5 - y0)/sqrt2sigmay))
+        out[i] = 0.25*DN_tot*Fx*Fy
+
+
+def _psf_jac_kernel(x, y, x0, y0, sigmax, sigmay, DN_tot, out):
+    """
+    Single-pass loop version of psf_jac for compilation with numba.
+    """
+    sqrt2sigmax = _sqrt2*sigmax
+    sqrt2sigmay = _sqrt2*sigmay
+    for i in range(x.shape[0]):
+        ux1 = (x[i] - 0.5 - x0)/sqrt2sigmax
+        ux2 = (x[i] + 0.5 - x0)/sqrt2sigmax
+        uy1 = (y[i] - 0.5 - y0)/sqrt2sigmay
+        uy2 = (y[i] + 0.5 - y0)/sqrt2sigmay
+        Fx = 0.5*(math.erf(ux2) - math.erf(ux1))
+        Fy = 0.5*(math.erf(uy2) - math.erf(uy1))
+        gx1, gx2 = math.exp(-ux1*ux1), math.exp(-ux2*ux2)
+        gy1, gy2 = math.exp(-uy1*uy1), math.exp(-uy2*uy2)
+        out[i, 0] = DN_tot*Fy*(gx1 - gx2)/(_sqrtpi*sqrt2sigmax)
+        out[i, 1] = DN_tot*Fx*(gy1 - gy2)/(_sqrtpi*sqrt2sigmay)
+        out[i, 2] = DN_tot*Fy*(ux1*gx1 - ux2*gx2)/(_sqrtpi*sigmax)
+        out[i, 3] = DN_tot*Fx*(uy1*gy1 - uy2*gy2)/(_sqrtpi*sigmay)
+        out[i, 4] = Fx*Fy
+
+
+if numba is not None:
+    # Use numpy's floating point error handling so that, e.g., sigma = 0
+    # gives the same results as the numpy path instead of raising
+    # ZeroDivisionError.
+    _psf_kernel = numba.njit(cache=True, error_model='numpy')(_psf_kernel)
+    _psf_jac_kernel \
+        = numba.njit(cache=True, error_model='numpy')(_psf_jac_kernel)
 
 
 def psf_sigma_statistics(sigma, bins=50, range=(2, 6), frac=0.5):
@@ -84,6 +136,50 @@ def pixel_integral(x, y, x0, y0, sigmax, sigmay):
     return 0.25*Fx*Fy
 
 
+def pixel_integral_derivs(x, y, x0, y0, sigmax, sigmay):
+    """
+    Compute the pixel integral of the 2D Gaussian, as in pixel_integral,
+    along with its partial derivatives with respect to x0, y0, sigmax,
+    and sigmay.
+    """
+    sqrt2sigmax = _sqrt2 * sigmax
+    sqrt2sigmay = _sqrt2 * sigmay
+
+    ux1 = (x - 0.5 - x0)/sqrt2sigmax
+    ux2 = (x + 0.5 - x0)/sqrt2sigmax
+    uy1 = (y - 0.5 - y0)/sqrt2sigmay
+    uy2 = (y + 0.5 - y0)/sqrt2sigmay
+
+    Fx = 0.5*(erf(ux2) - erf(ux1))
+    Fy = 0.5*(erf(uy2) - erf(uy1))
+
+    gx1, gx2 = np.exp(-ux1*ux1), np.exp(-ux2*ux2)
+    gy1, gy2 = np.exp(-uy1*uy1), np.exp(-uy2*uy2)
+
+    dFx_dx0 = (gx1 - gx2)/(_sqrtpi*sqrt2sigmax)
+    dFy_dy0 = (gy1 - gy2)/(_sqrtpi*sqrt2sigmay)
+    dFx_dsigmax = (ux1*gx1 - ux2*gx2)/(_sqrtpi*sigmax)
+    dFy_dsigmay = (uy1*gy1 - uy2*gy2)/(_sqrtpi*sigmay)
+
+    return (Fx*Fy, dFx_dx0*Fy, Fx*dFy_dy0, dFx_dsigmax*Fy, Fx*dFy_dsigmay)
+
+
+def psf_jac(pos, x0, y0, sigmax, sigmay, DN_tot):
+    """
+    Jacobian of psf_func with respect to (x0, y0, sigmax, sigmay, DN_tot)
+    for an array of pixel locations, pos, with shape (2, N).  Returns
+    an array with shape (N, 5).
+    """
+    if numba is not None:
+        jac = np.empty((pos.shape[1], 5))
+        _psf_jac_kernel(pos[0], pos[1], x0, y0, sigmax, sigmay, DN_tot, jac)
+        return jac
+    F, dF_dx0, dF_dy0, dF_dsigmax, dF_dsigmay \
+        = pixel_integral_derivs(pos[0], pos[1], x0, y0, sigmax, sigmay)
+    return np.column_stack((DN_tot*dF_dx0, DN_tot*dF_dy0,
+                            DN_tot*dF_dsigmax, DN_tot*dF_dsigmay, F))
+
+
 def residuals_single(pars, pos, dn, errors):
     x0, y0, sigma, DN_tot = pars
     return (dn - psf_func(pos.T, x0, y0, sigma, sigma, DN_tot))/errors
@@ -94,35 +190,89 @@ def residuals(pars, pos, dn, errors):
     return (dn - psf_func(pos.T, x0, y0, sigmax, sigmay, DN_tot))/errors
 
 
+def residuals_single_jac(pars, pos, dn, errors):
+    "Jacobian of residuals_single for use as the leastsq Dfun."
+    x0, y0, sigma, DN_tot = pars
+    jac = psf_jac(pos.T, x0, y0, sigma, sigma, DN_tot)
+    return -np.column_stack((jac[:, 0], jac[:, 1], jac[:, 2] + jac[:, 3],
+                             jac[:, 4]))/errors[:, None]
+
+
+def residuals_jac(pars, pos, dn, errors):
+    "Jacobian of residuals for use as the leastsq Dfun."
+    x0, y0, sigmax, sigmay, DN_tot = pars
+    return -psf_jac(pos.T, x0, y0, sigmax, sigmay, DN_tot)/errors[:, None]
+
+
 def psf_func_single_sigma(pos, x0, y0, sigma, DN_tot):
     return psf_func(pos, x0, y0, sigma, sigma, DN_tot)
 
 
 def psf_func(pos, x0, y0, sigmax, sigmay, DN_tot):
     """
-    For a pixel location or list of pixel locations, pos, compute the
-    DN per pixel for a 2D Gaussian with parameters:
+    For an array of pixel locations, pos, with shape (2, N), compute
+    the DN per pixel for a 2D Gaussian with parameters:
     x0, y0: Gaussian mean x and y values
     sigmax, sigmay: Gaussian widths in x- and y-directions
     DN_tot: Gaussian normalization in ADU
-    tie_xy: if True, then assume sigmax=sigmay in the fit.
+
+    The pixel integrals are evaluated for all N pixels at once.  A
+    single pixel location may be given as a length-2 array.
     """
-    #return DN_tot*np.array([pixel_integral(x[0], x[1], x0, y0,
-    #                                       sigmax, sigmay) for x in pos])
+    if pos.ndim == 1:
+        pos = pos.reshape(2, 1)
+    if numba is not None:
+        dn = np.empty(pos.shape[1])
+        _psf_kernel(pos[0], pos[1], x0, y0, sigmax, sigmay, DN_tot, dn)
+        return dn
     return DN_tot*pixel_integral(pos[0], pos[1], x0, y0, sigmax, sigmay)
 
 
 def chisq(pos, dn, x0, y0, sigmax, sigmay, dn_fit, dn_errors):
     "The chi-square of the fit of the data to psf_func."
-    return sum((psf_func(pos.T, x0, y0, sigmax, sigmay, dn_fit)
-                - np.array(dn))**2/dn_errors**2)
+    resids = residuals((x0, y0, sigmax, sigmay, dn_fit), pos, dn, dn_errors)
+    return float(np.dot(resids, resids))
+
+
+def fit_footprint(pos_array, zvals_array, dn_errors, npars=5):
+    """
+    Fit the Gaussian pixel-integral model to the pixel values of a
+    single footprint, using the cluster moments as starting values.
+    If npars == 5, the Gaussian widths in the x- and y-directions are
+    fit separately, otherwise a single width is fit.
+
+    Returns the best-fit (x0, y0, sigmax, sigmay, DN_tot) or None if
+    the fit could not be performed.
+    """
+    try:
+        cluster_stats = cluster_moments(zvals_array, pos_array)
+        if npars == 5:
+            pars, _ = scipy.optimize.leastsq(residuals, cluster_stats,
+                                             args=(pos_array, zvals_array,
+                                                   dn_errors),
+                                             Dfun=residuals_jac)
+            return tuple(pars)
+        sigma_xy = 0.5*(cluster_stats[2]+cluster_stats[3])
+        p0 = (cluster_stats[0], cluster_stats[1], sigma_xy, cluster_stats[4])
+        pars, _ = scipy.optimize.leastsq(residuals_single, p0,
+                                         args=(pos_array, zvals_array,
+                                               dn_errors),
+                                         Dfun=residuals_single_jac)
+        return pars[0], pars[1], pars[2], pars[2], pars[3]
+    except RuntimeError:
+        return None
+
+
+def _fit_footprint(args):
+    "Unpack the arguments for fit_footprint for use with Pool.map."
+    return fit_footprint(*args)
 
 
 def p9_values(peak, imarr, x0, y0, sigmax, sigmay, DN_tot):
     x5, y5 = peak.getIx(), peak.getIy()
     pos = np.array([(x5 + dyx[1], y5 + dyx[0]) for dyx in
                     itertools.product((-1, 0, 1), (-1, 0, 1))])
-    p9_data = np.array([imarr[y][x] for x, y in pos])
+    p9_data = imarr[pos[:, 1], pos[:, 0]]
     p9_model = psf_func(pos.T, x0, y0, sigmax, sigmay, DN_tot)
     return p9_data, p9_model
 
@@ -147,7 +297,7 @@ def prect_values(peak, imarr, ixm=3, ixp=3, iym=3, iyp=3):
 
 class PsfGaussFit(object):
     def __init__(self, nsig=3, min_npix=None, max_npix=20, gain_est=2,
-                 fit_xy=True, outfile=None):
+                 fit_xy=True, outfile=None, nproc=1):
         """
         nsig is the threshold in number of clipped stdev above median.
 
@@ -159,8 +309,15 @@ class PsfGaussFit(object):
         4- or 5-parameter fit.  If min_npix is None, then it is set to
         5 for a 4-parameter fit (fit_xy==False), otherwise it is set
         to 6 for a 5-parameter fit (fit_xy==True).
+
+        nproc is the number of processes to use for fitting the
+        footprints in each segment.  The process pool is created on
+        the first call to process_image and reused for subsequent
+        segments until close() is called.
         """
         self.nsig = nsig
+        self.nproc = nproc
+        self._pool = None
         if fit_xy:
             self.npars = 5
         else:
@@ -170,9 +327,10 @@ class PsfGaussFit(object):
         else:
             self.min_npix = min_npix
         self.max_npix = max_npix
-        self.sigmax, self.sigmay = [], []
-        self.dn, self.dn_fp, self.chiprob = [], [], []
-        self.amp = []
+        self.sigmax, self.sigmay = np.array([]), np.array([])
+        self.dn, self.dn_fp = np.array([]), np.array([])
+        self.chiprob = np.array([])
+        self.amp = np.array([])
         self.amp_set = set()
         self.outfile = outfile
         if outfile is None:
@@ -182,6 +340,23 @@ class PsfGaussFit(object):
             # Append new data to existing file.
             self.output = fits.open(self.outfile)
 
+    def _fit_footprints(self, work):
+        "Fit each of the footprints in the work list."
+        # The fits of the individual footprints are independent, so
+        # farm them out to a process pool if requested.
+        if self.nproc > 1 and len(work) > 1:
+            if self._pool is None:
+                self._pool = multiprocessing.Pool(processes=self.nproc)
+            return self._pool.map(_fit_footprint, work)
+        return [_fit_footprint(args) for args in work]
+
+    def close(self):
+        "Shut down the process pool used for the footprint fits."
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
     def _bg_image(self, image, ccd, nx, ny):
         "Compute background image based on clipped local mean."
         bg_ctrl = afwMath.BackgroundControl(nx, ny, ccd.stat_ctrl)
@@ -222,97 +397,67 @@ class PsfGaussFit(object):
         isotropic = False
         fpset = afwDetect.FootprintSet(fpset, grow, isotropic)
 
-        x0, y0 = [], []
-        sigmax, sigmay, dn, dn_fp, chiprob = [], [], [], [], []
-        chi2s, dofs = [], []
-        maxDNs = []
-        xpeak, ypeak = [], []
-        p9_data = []
-        p9_model = []
-        prect_data = []
         failed_curve_fits = 0
-        num_fp = 0
+        peaks, work = [], []
         for fp in fpset.getFootprints():
             if fp.getArea() < self.min_npix or fp.getArea() > self.max_npix:
                 continue
-            num_fp += 1
-            spans = fp.getSpans()
-            positions = []
-            zvals = []
-            peak = [pk for pk in fp.getPeaks()][0]
-            dn_sum = 0
-            for span in spans:
-                y = span.getY()
-                for x in range(span.getX0(), span.getX1() + 1):
-                    positions.append((x, y))
-                    zvals.append(imarr[y][x])
-                    dn_sum += imarr[y][x]
-            pos_array = np.array(positions)
-            zvals_array = np.array(zvals)
-            dn_sum = zvals_array.sum()
-            try:
-                # Use clipped stdev as DN error estimate for all pixels
-                dn_errors = stdev*np.ones(len(positions))
-                cluster_stats = cluster_moments(zvals_array, pos_array)
-                if self.npars == 5:
-                    pars, _ = scipy.optimize.leastsq(residuals, cluster_stats,
-                                                     args=(pos_array, zvals_array,
-                                                           dn_errors))
-                    sigmax.append(pars[2])
-                    sigmay.append(pars[3])
-                    dn.append(pars[4])
-                else:
-                    sigma_xy = 0.5*(cluster_stats[2]+cluster_stats[3])
-                    p0 = (cluster_stats[0], cluster_stats[1], sigma_xy, cluster_stats[4])
-                    pars, _ = scipy.optimize.leastsq(residuals_single, p0,
-                                                     args=(pos_array, zvals_array,
-                                                           dn_errors))
-                    sigmax.append(pars[2])
-                    sigmay.append(pars[2])
-                    dn.append(pars[3])
-                x0.append(pars[0])
-                y0.append(pars[1])
-                dn_fp.append(dn_sum)
-                chi2 = chisq(pos_array, zvals_array, x0[-1], y0[-1],
-                             sigmax[-1], sigmay[-1], dn[-1], dn_errors)
-                dof = fp.getArea() - self.npars
-                chiprob.append(gammaincc(dof/2., chi2/2.))
-                chi2s.append(chi2)
-                dofs.append(dof)
-                maxDNs.append(max(zvals))
-                try:
-                    p9_data_row, p9_model_row \
-                        = p9_values(peak, imarr, x0[-1], y0[-1], sigmax[-1],
-                                    sigmay[-1], dn[-1])
-                    prect_data_row = prect_values(peak,imarr)
-                    p9_data.append(p9_data_row)
-                    p9_model.append(p9_model_row)
-                    prect_data.append(prect_data_row)
-                    xpeak.append(peak.getIx())
-                    ypeak.append(peak.getIy())
-                except IndexError:
-                    [item.pop() for item in (x0, y0, sigmax, sigmay,
-                                             dn, dn_fp, chiprob,
-                                             chi2s, dofs, maxDNs)]
-            except RuntimeError:
+            peaks.append([pk for pk in fp.getPeaks()][0])
+            xs, ys = imutils.footprint_pixels(fp)
+            pos_array = np.column_stack((xs, ys)).astype(np.float64)
+            zvals_array = imarr[ys, xs]
+            # Use clipped stdev as DN error estimate for all pixels
+            dn_errors = stdev*np.ones(len(xs))
+            work.append((pos_array, zvals_array, dn_errors, self.npars))
+        num_fp = len(work)
+        fit_results = self._fit_footprints(work)
+
+        # Fill preallocated arrays with the results for each footprint,
+        # flagging the successful fits.
+        x0, y0, sigmax, sigmay, dn, dn_fp, chiprob, chi2s, maxDNs \
+            = np.zeros((9, num_fp))
+        dofs, xpeak, ypeak = np.zeros((3, num_fp), dtype=int)
+        p9_data, p9_model = np.zeros((2, num_fp, 9))
+        prect_data = np.zeros((num_fp, 49))
+        valid = np.zeros(num_fp, dtype=bool)
+        for i, (peak, (pos_array, zvals_array, dn_errors, _), pars) \
+                in enumerate(zip(peaks, work, fit_results)):
+            if pars is None:
                 failed_curve_fits += 1
-                pass
+                continue
+            try:
+                p9_data[i], p9_model[i] = p9_values(peak, imarr, *pars)
+            except IndexError:
+                continue
+            prect_data[i] = prect_values(peak, imarr)
+            x0[i], y0[i], sigmax[i], sigmay[i], dn[i] = pars
+            dn_fp[i] = zvals_array.sum()
+            chi2s[i] = chisq(pos_array, zvals_array, *pars, dn_errors)
+            dofs[i] = len(zvals_array) - self.npars
+            maxDNs[i] = zvals_array.max()
+            xpeak[i], ypeak[i] = peak.getIx(), peak.getIy()
+            valid[i] = True
+        chiprob[valid] = gammaincc(dofs[valid]/2., chi2s[valid]/2.)
         if logger is not None:
             logger.info("Number of footprints fitted: %i" % num_fp)
             if failed_curve_fits > 0:
                 logger.info("Failed scipy.optimize.leastsq calls: %s"
                             % failed_curve_fits)
+        x0, y0, sigmax, sigmay, dn, dn_fp, chiprob, chi2s, dofs, maxDNs, \
+            xpeak, ypeak, p9_data, p9_model, prect_data \
+            = [column[valid] for column in
+               (x0, y0, sigmax, sigmay, dn, dn_fp, chiprob, chi2s, dofs,
+                maxDNs, xpeak, ypeak, p9_data, p9_model, prect_data)]
         self._save_ext_data(amp, x0, y0, sigmax, sigmay, dn, dn_fp, chiprob,
                             chi2s, dofs, maxDNs, xpeak, ypeak,
-                            np.array(p9_data), np.array(p9_model),
-                            np.array(prect_data), seqnum)
+                            p9_data, p9_model, prect_data, seqnum)
         self.amp_set.add(amp)
-        self.sigmax.extend(sigmax)
-        self.sigmay.extend(sigmay)
-        self.dn.extend(dn)
-        self.dn_fp.extend(dn_fp)
-        self.chiprob.extend(chiprob)
-        self.amp.extend(np.ones(len(sigmax))*amp)
+        self.sigmax = np.concatenate((self.sigmax, sigmax))
+        self.sigmay = np.concatenate((self.sigmay, sigmay))
+        self.dn = np.concatenate((self.dn, dn))
+        self.dn_fp = np.concatenate((self.dn_fp, dn_fp))
+        self.chiprob = np.concatenate((self.chiprob, chiprob))
+        self.amp = np.concatenate((self.amp, np.ones(len(sigmax))*amp))
 
     def numGoodFits(self, chiprob_min=0.1):
         chiprob = np.array(self.chiprob)
@@ -340,25 +485,24 @@ class PsfGaussFit(object):
             row0 = table_hdu.header['NAXIS2']
             nrows = row0 + len(x0)
             table_hdu = fitsTableFactory(table_hdu.data, nrows=nrows)
-            for i in range(len(x0)):
-                row = i + row0
-                table_hdu.data[row]['AMPLIFIER'] = amp
-                table_hdu.data[row]['XPOS'] = x0[i]
-                table_hdu.data[row]['YPOS'] = y0[i]
-                table_hdu.data[row]['SIGMAX'] = sigmax[i]
-                table_hdu.data[row]['SIGMAY'] = sigmay[i]
-                table_hdu.data[row]['DN'] = dn[i]
-                table_hdu.data[row]['DN_FP_SUM'] = dn_fp[i]
-                table_hdu.data[row]['CHIPROB'] = chiprob[i]
-                table_hdu.data[row]['CHI2'] = chi2s[i]
-                table_hdu.data[row]['DOF'] = dofs[i]
-                table_hdu.data[row]['MAXDN'] = maxDNs[i]
-                table_hdu.data[row]['XPEAK'] = xpeak[i]
-                table_hdu.data[row]['YPEAK'] = ypeak[i]
-                table_hdu.data[row]['P9_DATA'] = p9_data[i]
-                table_hdu.data[row]['P9_MODEL'] = p9_model[i]
-                table_hdu.data[row]['PRECT_DATA'] = prect_data[i]
-                table_hdu.data[row]['SEQNUM'] = seqnum
+            rows = slice(row0, nrows)
+            table_hdu.data['AMPLIFIER'][rows] = amp
+            table_hdu.data['XPOS'][rows] = x0
+            table_hdu.data['YPOS'][rows] = y0
+            table_hdu.data['SIGMAX'][rows] = sigmax
+            table_hdu.data['SIGMAY'][rows] = sigmay
+            table_hdu.data['DN'][rows] = dn
+            table_hdu.data['DN_FP_SUM'][rows] = dn_fp
+            table_hdu.data['CHIPROB'][rows] = chiprob
+            table_hdu.data['CHI2'][rows] = chi2s
+            table_hdu.data['DOF'][rows] = dofs
+            table_hdu.data['MAXDN'][rows] = maxDNs
+            table_hdu.data['XPEAK'][rows] = xpeak
+            table_hdu.data['YPEAK'][rows] = ypeak
+            table_hdu.data['P9_DATA'][rows] = p9_data
+            table_hdu.data['P9_MODEL'][rows] = p9_model
+            table_hdu.data['PRECT_DATA'][rows] = prect_data
+            table_hdu.data['SEQNUM'][rows] = seqnum
             table_hdu.name = extname
             self.output[extname] = table_hdu
         except KeyError:
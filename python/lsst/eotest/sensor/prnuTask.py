@@ -5,7 +5,6 @@
 """
 from __future__ import absolute_import
 import os
-from collections import OrderedDict
 import numpy as np
 import astropy.io.fits as fits
 from lsst.eotest.fitsTools import fitsTableFactory, fitsWriteto
@@ -31,7 +30,7 @@ class PrnuTask(pipeBase.Task):
     @pipeBase.timeMethod
     def run(self, sensor_id, prnu_files, mask_files, gains, correction_image,
             bias_frame=None, linearity_correction=None):
-        results = OrderedDict()
+        results = dict()
         line = "wl (nm)  pixel_stdev    pixel_mean    stdev/mean"
         if self.config.verbose:
             self.log.info(line)
@@ -69,9 +68,10 @@ class PrnuTask(pipeBase.Task):
     def write(self, results, outfile, overwrite=True):
         colnames = ['WAVELENGTH', 'STDEV', 'MEAN']
         formats = 'IEE'
-        my_types = dict((("I", np.int), ("E", np.float)))
-        columns = [np.zeros(len(results), dtype=my_types[fmt])
-                   for fmt in formats]
+        wls = list(results.keys())
+        columns = [np.array(wls, dtype=int),
+                   np.array([results[wl][0] for wl in wls], dtype=float),
+                   np.array([results[wl][1] for wl in wls], dtype=float)]
         units = ['nm', 'rms e-', 'e-']
         hdu = fitsTableFactory([fits.Column(name=colnames[i],
                                             format=formats[i],
@@ -79,10 +79,6 @@ class PrnuTask(pipeBase.Task):
                                             array=columns[i])
                                 for i in range(len(colnames))])
         hdu.name = 'PRNU_RESULTS'
-        for i, wl in enumerate(results.keys()):
-            hdu.data.field('WAVELENGTH')[i] = wl
-            hdu.data.field('STDEV')[i] = results[wl][0]
-            hdu.data.field('MEAN')[i] = results[wl][1]
         if os.path.isfile(outfile):
             output = fits.open(outfile)
         else:
@@ -5,6 +5,7 @@ conditions.  Darks, flats, Fe55, etc..
 from __future__ import print_function
 from __future__ import absolute_import
 import os
+import functools
 from collections import OrderedDict
 import datetime
 import astropy.time
@@ -24,6 +25,7 @@ from .AmplifierGeometry import AmplifierGeometry
 from .crosstalk import CrosstalkMatrix
 
 _sqrt2 = np.sqrt(2.)
+_all_amps = np.array(imutils.allAmps())
 
 
 def utcnow(dt=0):
@@ -42,7 +44,7 @@ class CrosstalkPattern(object):
             pattern = (0.01, 0.02, 1, 0.02, 0.01)
             offsets = (-2, -1, 0, 1, 2)
             namps = len(imutils.allAmps())
-            self.matrix = np.zeros((namps, namps), dtype=np.float)
+            self.matrix = np.zeros((namps, namps), dtype=float)
             for agg in imutils.allAmps():
                 for offset, value in zip(offsets, pattern):
                     vic = agg + offset
@@ -55,33 +57,86 @@ class CrosstalkPattern(object):
                      in zip(imutils.allAmps(), self.matrix[aggressor-1])])
 
 
+@functools.lru_cache(maxsize=None)
+def _xtalk_fracs(aggressor, frac_scale):
+    """
+    Crosstalk fractions for all amps, ordered as in _all_amps.  The
+    fractions only depend on the aggressor-victim distance, so they
+    are taken from a single 1/distance**2 profile.
+    """
+    nside = _all_amps.size//2
+    profile = frac_scale/np.arange(1, nside)**2
+    dist = np.abs(_all_amps - aggressor)
+    same_side = (((_all_amps - 1)//nside == (aggressor - 1)//nside)
+                 & (dist > 0))
+    frac = np.zeros(_all_amps.size)
+    frac[same_side] = profile[dist[same_side] - 1]
+    return tuple(frac.tolist())
+
+
 def xtalk_pattern(aggressor, frac_scale=0.02):
-    xtalk_frac = {}
-    nside = len(imutils.allAmps())/2
-    for victim in imutils.allAmps():
-        if (victim != aggressor and
-                (victim-1)/nside == (aggressor-1)/nside):
-            dist = abs(victim - aggressor)
-            xtalk_frac[victim] = frac_scale/dist**2
-        else:
-            xtalk_frac[victim] = 0
-    return xtalk_frac
+    """
+    Crosstalk fractions for each victim amp, falling off as
+    1/distance**2 from the aggressor for amps on the same side of the
+    CCD and zero otherwise.
+    """
+    return dict(zip(_all_amps.tolist(), _xtalk_fracs(aggressor, frac_scale)))
+
+
+@functools.lru_cache(maxsize=16)
+def spot_stamp(radius):
+    """
+    Unit amplitude image of a circular spot, covering pixel offsets
+    from -radius to radius - 1 in x and y relative to the spot center.
+    The stamp is cached, so it is returned as a read-only array.
+    """
+    offsets = np.arange(-radius, radius)
+    stamp = np.array(offsets[:, None]**2 + offsets[None, :]**2 < radius**2,
+                     dtype=np.float32)
+    stamp.setflags(write=False)
+    return stamp
+
+
+def _make_rng(seed=None):
+    """
+    Create the numpy.random.Generator used for the simulated pixel
+    data.  If seed is None, the Generator is seeded from the global
+    numpy RandomState, so that numpy.random.seed can still be used to
+    make the simulations reproducible.
+    """
+    if seed is None:
+        seed = random.randint(2**32, dtype=np.uint64)
+    return np.random.default_rng(seed)
 
 
 class CCD(object):
     dtypes = dict([(-32, np.float32), (16, np.int16)])
 
     def __init__(self, exptime=1, gain=5, ccdtemp=-95, full_well=None,
-                 geometry=AmplifierGeometry(), amps=None):
+                 geometry=AmplifierGeometry(), amps=None, buffers=None,
+                 seed=None):
+        """
+        If buffers is not None, it should be a dict of preallocated
+        float32 full segment arrays, keyed by amp, that are used as the
+        segment images instead of allocating new ones.  The contents of
+        those arrays are not reset.
+
+        All of the random draws for the segments are made from a
+        single numpy.random.Generator created by _make_rng(seed).
+        """
+        self._rng = _make_rng(seed)
         self.segments = OrderedDict()
         if amps is None:
             amps = imutils.allAmps()
         for amp in amps:
+            image_array = buffers[amp] if buffers is not None else None
             self.segments[amp] = SegmentExposure(exptime=exptime,
                                                  gain=gain,
                                                  ccdtemp=ccdtemp,
                                                  full_well=full_well,
-                                                 geometry=geometry)
+                                                 geometry=geometry,
+                                                 image_array=image_array,
+                                                 rng=self._rng)
         self.md = dict()
 
     def add_bias(self, level=1e4, sigma=4):
@@ -139,16 +194,18 @@ class CCD(object):
 
     def writeto(self, outfile, pars=None, bitpix=16, obs_time=None,
                 compress_images=True):
+        output = self.to_hdulist(pars=pars, bitpix=bitpix, obs_time=obs_time)
+        fitsWriteto(output, outfile, overwrite=True, checksum=True,
+                    compress_images=compress_images)
+
+    def to_hdulist(self, pars=None, bitpix=16, obs_time=None):
+        """
+        Return the simulated CCD data as an astropy.io.fits.HDUList
+        in the same format as is written by the writeto method.
+        """
         ccd_segments = [self.segments[amp] for amp in self.segments]
         output = fitsFile(ccd_segments)
-        if pars is not None:
-            output[0].header['CCDGAIN'] = pars.system_gain
-            output[0].header['BIASLVL'] = pars.bias_level
-            output[0].header['CCDNOISE'] = pars.bias_sigma
-            output[0].header['RDNOISE'] = pars.read_noise
-            output[0].header['DARKCURR'] = pars.dark_current
-        for key, value in list(self.md.items()):
-            output[0].header[key] = value
+        self._set_primary_keywords(output[0].header, pars, obs_time)
         if bitpix > 0:
             my_round = np.round
         else:
@@ -163,45 +220,78 @@ class CCD(object):
             def my_round(x): return x
         for hdu in output[1:-2]:
             hdu.data = np.array(my_round(hdu.data), dtype=self.dtypes[bitpix])
+        return output
+
+    def primary_header(self, pars=None, obs_time=None):
+        """
+        Return the primary HDU header for the simulated CCD data as
+        written by the writeto method, without building the HDUs for
+        the pixel data.
+        """
+        segment = next(iter(self.segments.values()))
+        header = fits_headers()['PRIMARY'].copy()
+        header['EXPTIME'] = segment.exptime
+        header['CCDTEMP'] = segment.ccdtemp
+        self._set_primary_keywords(header, pars, obs_time)
+        return header
+
+    def _set_primary_keywords(self, header, pars, obs_time):
+        if pars is not None:
+            header['CCDGAIN'] = pars.system_gain
+            header['BIASLVL'] = pars.bias_level
+            header['CCDNOISE'] = pars.bias_sigma
+            header['RDNOISE'] = pars.read_noise
+            header['DARKCURR'] = pars.dark_current
+        for key, value in list(self.md.items()):
+            header[key] = value
         if obs_time is None:
             # Compute the start of the observation from the current time
             # minus the exposure time.
-            obs_time = utcnow(dt=-output[0].header['EXPTIME'])
-        output[0].header['DATE-OBS'] = obs_time.isot
-        output[0].header['DATE'] = obs_time.isot
-        output[0].header.set('MJD-OBS', value=float('%.5f' % obs_time.mjd))
-        fitsWriteto(output, outfile, overwrite=True, checksum=True,
-                    compress_images=compress_images)
+            obs_time = utcnow(dt=-header['EXPTIME'])
+        header['DATE-OBS'] = obs_time.isot
+        header['DATE'] = obs_time.isot
+        header.set('MJD-OBS', value=float('%.5f' % obs_time.mjd))
 
 
 class SegmentExposure(object):
     def __init__(self, exptime=1, gain=5, ccdtemp=-95, full_well=None,
-                 geometry=AmplifierGeometry()):
+                 geometry=AmplifierGeometry(), image_array=None, rng=None):
         self.exptime = exptime
         self.gain = gain
         self.ccdtemp = ccdtemp
         self.full_well = full_well
         self.geometry = geometry
         self.fe55_yield = Fe55Yield(ccdtemp)
-        self.image = afwImage.ImageF(geometry.full_segment)
+        if image_array is None:
+            self.image = afwImage.ImageF(geometry.full_segment)
+        else:
+            # Wrap the preallocated array without copying it.
+            self.image = afwImage.ImageF(image_array, deep=False)
         self.imarr = self.image.Factory(self.image, geometry.imaging).getArray()
         self.ny, self.nx = self.imarr.shape
         self.npix = self.nx*self.ny
         self._sigma = -1
+        if rng is None:
+            rng = _make_rng()
+        self._rng = rng
 
     def add_bias(self, level=1e4, sigma=4):
         """The parameters level and bias are in units of e- and
         converted on output to DN via the system gain."""
         fullarr = self.image.getArray()
-        ny, nx = fullarr.shape
-        bias_arr = np.array(random.normal(level, sigma, nx*ny),
-                            dtype=np.float).reshape(ny, nx)
-        fullarr += bias_arr/self.gain
+        # Draw the noise directly in the float32 precision of the
+        # image array and scale it in place.
+        bias_arr = self._rng.standard_normal(fullarr.shape, dtype=np.float32)
+        bias_arr *= sigma/self.gain
+        bias_arr += level/self.gain
+        fullarr += bias_arr
 
     def add_dark_current(self, level=2e-3):
         """Units of level should be e- per unit time and converted to
         DN on output."""
-        dark_arr = self._poisson_imarr(level*self.exptime)/self.gain
+        dark_arr = np.asarray(self._poisson_imarr(level*self.exptime),
+                              dtype=np.float32)
+        dark_arr /= self.gain
         self.imarr += dark_arr
 
     def expose_flat(self, intensity=0):
@@ -215,7 +305,7 @@ class SegmentExposure(object):
             self.imarr[indx] = self.full_well/self.gain
 
     def _poisson_imarr(self, Ne):
-        return random.poisson(Ne, self.npix).reshape(self.ny, self.nx)
+        return self._rng.poisson(Ne, self.npix).reshape(self.ny, self.nx)
 
     def sigma(self):
         if self._sigma == -1:
@@ -224,7 +314,7 @@ class SegmentExposure(object):
 
     def generate_bright_cols(self, ncols=1):
         bright_cols = np.arange(self.nx)
-        random.shuffle(bright_cols)
+        self._rng.shuffle(bright_cols)
         return bright_cols[:ncols]
 
     def set_dark_cols(self, columns, frac):
@@ -237,7 +327,7 @@ class SegmentExposure(object):
 
     def generate_bright_pix(self, npix=100):
         bright_pix = np.concatenate((np.ones(npix), np.zeros(self.npix-npix)))
-        random.shuffle(bright_pix)
+        self._rng.shuffle(bright_pix)
         bright_pix = bright_pix.reshape(self.ny, self.nx)
         return bright_pix
 
@@ -272,9 +362,9 @@ class SegmentExposure(object):
         if sigma is None:
             # Generated charge per hit is contained within a single pixel.
             for i in range(nxrays):
-                x0 = random.randint(nx)
-                y0 = random.randint(ny)
-                if random.random() < beta_frac:
+                x0 = self._rng.integers(nx)
+                y0 = self._rng.integers(ny)
+                if self._rng.random() < beta_frac:
                     signal = Ne_beta/self.gain
                 else:
                     signal = Ne_alpha/self.gain
@@ -282,15 +372,15 @@ class SegmentExposure(object):
         else:
             # Draw interaction point from full imaging region and e-
             # pixel distribution from 2D Gaussian.
-            x0_values = random.uniform(0, nx, nxrays)
-            y0_values = random.uniform(0, ny, nxrays)
+            x0_values = self._rng.uniform(0, nx, nxrays)
+            y0_values = self._rng.uniform(0, ny, nxrays)
             for x0, y0 in zip(x0_values, y0_values):
-                if random.random() < beta_frac:
+                if self._rng.random() < beta_frac:
                     Ne = Ne_beta
                 else:
                     Ne = Ne_alpha
-                xvals = random.normal(x0, sigma, size=Ne)
-                yvals = random.normal(y0, sigma, size=Ne)
+                xvals = self._rng.normal(x0, sigma, size=Ne)
+                yvals = self._rng.normal(y0, sigma, size=Ne)
                 for xx, yy in zip(xvals, yvals):
                     try:
                         self.imarr[yy][xx] += 1./self.gain
@@ -300,11 +390,16 @@ class SegmentExposure(object):
         self.imarr = np.round(self.imarr)
 
     def add_spot_image(self, dn, xref, yref, radius):
-        r2 = radius**2
-        for x in range(xref-radius, xref+radius, 1):
-            for y in range(yref-radius, yref+radius, 1):
-                if ((x - xref)**2 + (y - yref)**2 < r2):
-                    self.imarr[y][x] += dn
+        self.add_scaled_stamp(spot_stamp(radius), xref, yref, dn)
+
+    def add_scaled_stamp(self, stamp, x, y, amplitude):
+        """
+        Add amplitude times stamp to the imaging region, with the
+        stamp center at pixel (x, y).
+        """
+        ny, nx = stamp.shape
+        y0, x0 = y - ny//2, x - nx//2
+        self.imarr[y0:y0+ny, x0:x0+nx] += amplitude*stamp
 
     def add_sys_xtalk_col(self, dn, column):
         self.imarr[:, column] += dn
@@ -39,40 +39,35 @@ def make_ccd_mosaic(infile, bias_frame=None, dark_frame=None, gains=None, linear
     ccd = MaskedCCD(infile, bias_frame=bias_frame, dark_frame=dark_frame, linearity_correction=None)
 
     ## Get amp geometry information
-    foo = fits.open(infile)
-    datasec = parse_geom_kwd(foo[1].header['DATASEC'])
     nx_segments = 8
     ny_segments = 2
+    with fits.open(infile) as foo:
+        datasec = parse_geom_kwd(foo[1].header['DATASEC'])
+        detsecs = [parse_geom_kwd(foo[amp].header['DETSEC'])
+                   for amp in range(1, nx_segments*ny_segments + 1)]
     nx = nx_segments*(datasec['xmax'] - datasec['xmin'] + 1)
     ny = ny_segments*(datasec['ymax'] - datasec['ymin'] + 1)
-    raw = np.zeros((ny, nx), dtype=np.float32)
-    mosaic = np.zeros((ny, nx), dtype=np.float32)
+    mosaic = np.empty((ny, nx), dtype=np.float32)
 
     for ypos in range(ny_segments):
         for xpos in range(nx_segments):
 
             amp = ypos*nx_segments + xpos + 1
-            detsec = parse_geom_kwd(foo[amp].header['DETSEC'])
-            xmin = nx - max(detsec['xmin'], detsec['xmax'])
-            xmax = nx - min(detsec['xmin'], detsec['xmax']) + 1
+            detsec = detsecs[amp - 1]
+            xmin = min(detsec['xmin'], detsec['xmax']) - 1
+            xmax = max(detsec['xmin'], detsec['xmax'])
             ymin = ny - max(detsec['ymin'], detsec['ymax'])
             ymax = ny - min(detsec['ymin'], detsec['ymax']) + 1
             subarr = ccd.unbiased_and_trimmed_image(amp).getImage().getArray()
-                    
-            ## Flip array orientation (if applicable)
-            if detsec['xmax'] > detsec['xmin']: # flip in x-direction
-                subarr = subarr[:, ::-1]
-            if detsec['ymax'] > detsec['ymin']: # flip in y-direction
-                subarr = subarr[::-1, :]
-
-            ## Gain correction
-            if gains is not None:
-                subarr *= gains[amp]
 
-            ## Assign to final array
-            raw[ymin:ymax, xmin:xmax] = subarr
+            ## Flip array orientation (if applicable)
+            xstep = -1 if detsec['xmin'] > detsec['xmax'] else 1
+            ystep = -1 if detsec['ymax'] > detsec['ymin'] else 1
 
-    mosaic[:, : ] = raw[:, ::-1]
+            ## Apply the gain correction while assigning to the final array
+            gain = gains[amp] if gains is not None else 1
+            np.multiply(subarr[::ystep, ::xstep], gain,
+                        out=mosaic[ymin:ymax, xmin:xmax], casting='unsafe')
 
     image = afwImage.ImageF(mosaic)
     return image
@@ -6,9 +6,11 @@
 import os
 import unittest
 import numpy as np
+import astropy.io.fits as fits
 import lsst.eotest.image_utils as imutils
 from lsst.eotest.sensor import MaskedCCD, add_mask_files, BrightPixels, \
     AmplifierGeometry, generate_mask
+from lsst.eotest.sensor.MaskedCCD import read_mask_arrays
 import lsst.eotest.sensor.sim_tools as sim_tools
 import lsst.afw.image as afwImage
 import lsst.afw.math as afwMath
@@ -92,6 +94,43 @@ class MaskedCCDTestCase(unittest.TestCase):
             self.assertEqual(sctrl.getAndMask(), 2**bit)
 
 
+class ReadMaskArraysTestCase(unittest.TestCase):
+    """Test case for read_mask_arrays."""
+    mask_file = 'read_mask_arrays_test.fits'
+    amps = (1, 2)
+
+    def setUp(self):
+        # Write a mask file with the mask plane bits in the reverse
+        # order of the current mask plane dict, a new mask plane, and
+        # an unnamed bit that should be dropped.
+        mpd = afwImage.Mask().getMaskPlaneDict()
+        file_bits = dict((plane, len(mpd) - 1 - bit)
+                         for plane, bit in mpd.items())
+        file_bits['EOTEST_READ_MASK_TEST'] = 30
+        unnamed_bit = 29
+        rng = np.random.default_rng(1000)
+        output = fits.HDUList([fits.PrimaryHDU()])
+        for amp in self.amps:
+            imarr = np.zeros((100, 50), dtype=np.int32)
+            for bit in list(file_bits.values()) + [unnamed_bit]:
+                imarr |= (rng.random(imarr.shape) < 0.1).astype(np.int32) \
+                    << bit
+            output.append(fits.ImageHDU(data=imarr))
+            for plane, bit in file_bits.items():
+                output[-1].header['MP_' + plane] = bit
+        output.writeto(self.mask_file, overwrite=True)
+
+    def tearDown(self):
+        os.remove(self.mask_file)
+
+    def test_read_mask_arrays(self):
+        "Compare read_mask_arrays to reading the masks with afw."
+        mask_arrays = read_mask_arrays(self.mask_file, self.amps)
+        for amp in self.amps:
+            mask = afwImage.Mask(self.mask_file, imutils.dm_hdu(amp))
+            np.testing.assert_array_equal(mask_arrays[amp], mask.getArray())
+
+
 class MaskedCCD_biasHandlingTestCase(unittest.TestCase):
     bias_slope = 1e-3
     bias_intercept = 0.5
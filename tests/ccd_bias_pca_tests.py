@@ -0,0 +1,167 @@
+"""
+Unit tests for the ccd_bias_pca module.
+"""
+import os
+import glob
+import threading
+import unittest
+import numpy as np
+import astropy.io.fits as fits
+import lsst.afw.image as afwImage
+import lsst.afw.math as afwMath
+import lsst.eotest.sensor.sim_tools as sim_tools
+import lsst.eotest.sensor.ccd_bias_pca as ccd_bias_pca
+
+
+def simulated_frame(ny=500, nx=200, sigma=5., seed=1000):
+    """Frame with a linear background gradient plus Gaussian noise."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:ny, :nx]
+    return np.array(1000. + 0.01*xx + 0.02*yy + rng.normal(0, sigma, (ny, nx)),
+                    dtype=np.float32)
+
+
+class BlockBackgroundTestCase(unittest.TestCase):
+    """Test case for the local background model used by defect_repair."""
+
+    def setUp(self):
+        self.sigma = 5.
+        self.imarr = simulated_frame(sigma=self.sigma)
+        ny, nx = self.imarr.shape
+        self.nbins_x = max(10, nx//10)
+        self.nbins_y = max(10, ny//10)
+        self.grid = ccd_bias_pca._background_grid(self.imarr.shape,
+                                                  self.nbins_x, self.nbins_y)
+
+    def test_block_medians(self):
+        "Compare the block medians to a direct loop over the blocks."
+        yedges, xedges = self.grid[:2]
+        expected = np.empty((len(yedges) - 1, len(xedges) - 1))
+        for j in range(len(yedges) - 1):
+            for i in range(len(xedges) - 1):
+                expected[j, i] = np.median(self.imarr[yedges[j]:yedges[j+1],
+                                                      xedges[i]:xedges[i+1]])
+        funcs = [ccd_bias_pca._block_medians_numpy]
+        if ccd_bias_pca._block_medians_parallel is not None:
+            funcs.append(ccd_bias_pca._block_medians_parallel)
+        for func in funcs:
+            medians = np.empty_like(expected)
+            func(self.imarr, yedges, xedges, medians)
+            np.testing.assert_array_equal(medians, expected)
+
+    def test_parallel_background(self):
+        "Check that the parallel option does not change the background."
+        np.testing.assert_array_equal(
+            ccd_bias_pca._block_background(self.imarr, self.grid,
+                                           parallel=True),
+            ccd_bias_pca._block_background(self.imarr, self.grid))
+
+    def test_afw_background(self):
+        "Compare the background model to the afw background."
+        bg = ccd_bias_pca._block_background(self.imarr, self.grid)
+        image = afwImage.ImageF(self.imarr.copy())
+        bg_ctrl = afwMath.BackgroundControl(self.nbins_x, self.nbins_y)
+        afw_bg = afwMath.makeBackground(image, bg_ctrl).getImageF().array
+        # The models differ in the block statistic (median vs clipped
+        # mean) and interpolation, so only compare them between the
+        # outermost block centers and at the level of the noise in
+        # the block statistics.
+        yedges, xedges = self.grid[:2]
+        ymin = (yedges[0] + yedges[1])//2
+        ymax = (yedges[-2] + yedges[-1])//2
+        xmin = (xedges[0] + xedges[1])//2
+        xmax = (xedges[-2] + xedges[-1])//2
+        diff = (bg - afw_bg)[ymin:ymax, xmin:xmax]
+        self.assertLess(np.max(np.abs(diff)), self.sigma/2.)
+        self.assertLess(np.mean(np.abs(diff)), 0.4)
+        self.assertLess(np.abs(np.mean(diff)), 0.1)
+
+
+class DefectRepairTestCase(unittest.TestCase):
+    """Test case for defect_repair and _DefectRepairer."""
+
+    def setUp(self):
+        self.imarr = simulated_frame()
+        self.background = simulated_frame(sigma=0)
+        self.defects = ((100, 50), (250, 120), (400, 170))
+        for y, x in self.defects:
+            self.imarr[y, x] += 500.
+
+    def test_defect_repair(self):
+        "Check that the injected defects are masked and repaired."
+        repaired = ccd_bias_pca.defect_repair(self.imarr)
+        for y, x in self.defects:
+            self.assertTrue(repaired.mask[y, x])
+            self.assertLess(abs(repaired.data[y, x] - self.background[y, x]),
+                            25.)
+        self.assertLess(np.sum(repaired.mask), 100)
+        unmasked = ~repaired.mask
+        np.testing.assert_array_equal(repaired.data[unmasked],
+                                      self.imarr[unmasked])
+
+    def test_scratch_reuse(self):
+        "Check that reusing the scratch buffers gives the same results."
+        repairer = ccd_bias_pca._DefectRepairer()
+        expected = ccd_bias_pca.defect_repair(self.imarr)
+        results = [repairer.repair(self.imarr),
+                   repairer.repair(self.imarr[:300, :150]),
+                   repairer.repair(self.imarr)]
+        thread_results = []
+        thread = threading.Thread(
+            target=lambda: thread_results.append(repairer.repair(self.imarr)))
+        thread.start()
+        thread.join()
+        for result in (results[0], results[2], thread_results[0]):
+            np.testing.assert_array_equal(result.data, expected.data)
+            np.testing.assert_array_equal(result.mask, expected.mask)
+
+
+class MedianAxis0TestCase(unittest.TestCase):
+    """Test case for _median_axis0."""
+
+    def test_median_axis0(self):
+        rng = np.random.default_rng(1000)
+        for nimages in (1, 2, 5, 6):
+            stack = rng.normal(size=(nimages, 20, 30)).astype(np.float32)
+            np.testing.assert_allclose(ccd_bias_pca._median_axis0(stack),
+                                       np.median(stack, axis=0), rtol=1e-6)
+
+
+class PcaSuperbiasTestCase(unittest.TestCase):
+    """Test case for pca_superbias."""
+    prefix = 'pca_superbias_test'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.bias_files = []
+        for i in range(4):
+            ccd = sim_tools.CCD(seed=i)
+            ccd.add_bias(level=1e4 + 10*i, sigma=4)
+            bias_file = f'{cls.prefix}_bias_{i:02d}.fits'
+            ccd.writeto(bias_file, bitpix=16)
+            cls.bias_files.append(bias_file)
+        ccd_pcas = ccd_bias_pca.CCD_bias_PCA(ncomp_x=2, ncomp_y=2)
+        cls.pca_files = ccd_pcas.compute_pcas(cls.bias_files, cls.prefix)
+
+    @classmethod
+    def tearDownClass(cls):
+        for item in glob.glob(f'{cls.prefix}*'):
+            os.remove(item)
+
+    def test_nthreads(self):
+        "Check that threading does not change the superbias frame."
+        outfiles = []
+        for nthreads in (1, 2):
+            outfile = f'{self.prefix}_superbias_{nthreads}.fits'
+            ccd_bias_pca.pca_superbias(self.bias_files, self.pca_files,
+                                       outfile, nthreads=nthreads)
+            outfiles.append(outfile)
+        with fits.open(outfiles[0]) as serial, \
+             fits.open(outfiles[1]) as threaded:
+            for amp in range(1, 17):
+                np.testing.assert_array_equal(serial[amp].data,
+                                              threaded[amp].data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,82 +5,173 @@
 """
 import os
 import unittest
+import numpy as np
 import lsst.eotest.image_utils as imutils
 from lsst.eotest.sensor import MaskedCCD
 import lsst.eotest.sensor.sim_tools as sim_tools
 import lsst.eotest.sensor.crosstalk as crosstalk
 
+_ALL_AMPS = imutils.allAmps()
+
 
 class CrosstalkTestCase(unittest.TestCase):
     """Test case for crosstalk code."""
 
-    def setUp(self):
-        self.xtalk_file = 'xtalk_test.fits'
-        self.aggressor = 6
+    @classmethod
+    def setUpClass(cls):
+        cls.aggressor = 6
         dn = 2000
         x, y, radius = 250, 250, 20
-        self.xtalk_frac = sim_tools.xtalk_pattern(self.aggressor)
-        ccd = generate_crosstalk_frame(self.aggressor, dn, x, y, radius,
-                                       xtalk_frac=self.xtalk_frac)
-        ccd.writeto(self.xtalk_file)
+        cls.xtalk_frac = sim_tools.xtalk_pattern(cls.aggressor)
+        # Keep the frame in memory rather than writing it to disk.
+        cls.xtalk_ccd = generate_crosstalk_frame(cls.aggressor, dn, x, y,
+                                                 radius,
+                                                 xtalk_frac=cls.xtalk_frac)
+
+    def setUp(self):
+        self.xtalk_file = 'xtalk_test.fits'
 
     def tearDown(self):
-        os.remove(self.xtalk_file)
+        if os.path.isfile(self.xtalk_file):
+            os.remove(self.xtalk_file)
 
     def test_detector_crosstalk(self):
-        ccd = MaskedCCD(self.xtalk_file)
+        ccd = MaskedCCD(self.xtalk_ccd)
         ratios = crosstalk.detector_crosstalk(ccd, self.aggressor)
         for amp in ratios:
             if amp != self.aggressor:
                 self.assertTrue(abs(ratios[amp][0] - self.xtalk_frac[amp])
                                 < ratios[amp][1])
 
+    def test_single_hdulist(self):
+        """Check that a single HDUList is handled as a single frame."""
+        frame = self.xtalk_ccd.to_hdulist(bitpix=-32)
+        det_xtalk = crosstalk.make_crosstalk_matrix(frame, verbose=False)
+        ratios = crosstalk.detector_crosstalk(MaskedCCD(frame),
+                                              self.aggressor)
+        for amp in _ALL_AMPS:
+            self.assertAlmostEqual(det_xtalk.matrix[self.aggressor-1][amp-1],
+                                   ratios[amp][0])
+
+    def test_fits_roundtrip(self):
+        """Check that the on-disk path gives the same pixels and ratios."""
+        self.xtalk_ccd.writeto(self.xtalk_file, bitpix=-32,
+                               compress_images=False)
+        ccd = MaskedCCD(self.xtalk_file)
+        ccd_mem = MaskedCCD(self.xtalk_ccd)
+        self.assertEqual(list(ccd.keys()), list(ccd_mem.keys()))
+        for amp in ccd_mem:
+            np.testing.assert_array_equal(ccd[amp].getImage().getArray(),
+                                          ccd_mem[amp].getImage().getArray())
+        for region in ('full_segment', 'imaging', 'serial_overscan',
+                       'parallel_overscan'):
+            self.assertEqual(getattr(ccd.amp_geom, region),
+                             getattr(ccd_mem.amp_geom, region))
+        for key in ('EXPTIME', 'CCDTEMP', 'DETSIZE'):
+            self.assertEqual(ccd.md.get(key), ccd_mem.md.get(key))
+        ratios = crosstalk.detector_crosstalk(ccd, self.aggressor)
+        ratios_mem = crosstalk.detector_crosstalk(ccd_mem, self.aggressor)
+        for amp in ratios_mem:
+            self.assertAlmostEqual(ratios[amp][0], ratios_mem[amp][0])
+
 
 class CrosstalkMatrixTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Make and measure the frames one at a time in this process,
+        # so that only a single frame is held in memory.
+        ccds = (MaskedCCD(ccd) for ccd in crosstalk_frames())
+        cls.det_xtalk = crosstalk.make_crosstalk_matrix(ccds, verbose=False)
+
     def setUp(self):
+        self.matrix_npz_output = 'xtalk_output.npz'
         self.matrix_text_output = 'xtalk_output.txt'
         self.matrix_fits_output = 'xtalk_output.fits'
-        self.xtalk_files = []
-        for agg in imutils.allAmps():
-            self.xtalk_files.append('xtalk_test_%02i.fits' % agg)
-            xtalk_frac = sim_tools.xtalk_pattern(agg)
-            ccd = generate_crosstalk_frame(agg, 2000, 250, 250, 20,
-                                           xtalk_frac=xtalk_frac)
-            ccd.writeto(self.xtalk_files[-1])
+        self.matrix_dat_output = 'xtalk_output.dat'
 
     def tearDown(self):
-        for item in self.xtalk_files:
-            os.remove(item)
-        os.remove(self.matrix_text_output)
-        os.remove(self.matrix_fits_output)
+        for outfile in (self.matrix_npz_output, self.matrix_text_output,
+                        self.matrix_fits_output,
+                        self.matrix_dat_output + '.npz'):
+            if os.path.isfile(outfile):
+                os.remove(outfile)
+
+    def _check_roundtrip(self, outfile):
+        det_xtalk2 = crosstalk.CrosstalkMatrix(outfile)
+        diff = self.det_xtalk - det_xtalk2
+        self.assertTrue(np.abs(diff.matrix).max() < 1e-4)
 
     def test_CrosstalkMatrix(self):
-        det_xtalk = crosstalk.make_crosstalk_matrix(self.xtalk_files,
-                                                    verbose=False)
-        det_xtalk.write(self.matrix_text_output)
-        det_xtalk.write_fits(self.matrix_fits_output)
+        self.det_xtalk.write_npz(self.matrix_npz_output)
+        self._check_roundtrip(self.matrix_npz_output)
 
-        det_xtalk2 = crosstalk.CrosstalkMatrix(self.matrix_text_output)
-        diff = det_xtalk - det_xtalk2
-        self.assertTrue(max([abs(x) for x in diff.matrix.flat]) < 1e-4)
+    def test_CrosstalkMatrix_npz_suffix(self):
+        self.det_xtalk.write_npz(self.matrix_dat_output)
+        npz_file = self.matrix_dat_output + '.npz'
+        self.assertEqual(self.det_xtalk.filename, npz_file)
+        self.assertFalse(os.path.isfile(self.matrix_dat_output))
+        self._check_roundtrip(self.det_xtalk.filename)
 
-        det_xtalk3 = crosstalk.CrosstalkMatrix(self.matrix_fits_output)
-        diff = det_xtalk - det_xtalk3
-        self.assertTrue(max([abs(x) for x in diff.matrix.flat]) < 1e-4)
+    def test_CrosstalkMatrix_text_roundtrip(self):
+        self.det_xtalk.write(self.matrix_text_output)
+        self._check_roundtrip(self.matrix_text_output)
 
+    def test_CrosstalkMatrix_fits_roundtrip(self):
+        self.det_xtalk.write_fits(self.matrix_fits_output)
+        self._check_roundtrip(self.matrix_fits_output)
 
-def generate_crosstalk_frame(aggressor, dn, x, y, radius,
-                             xtalk_frac=None, nom_frac=0.1):
-    if xtalk_frac is None:
-        xtalk_frac = dict([(amp, nom_frac) for amp in imutils.allAmps])
-    ccd = sim_tools.CCD()
+
+def bias_dark_arrays():
+    """Full segment pixel arrays with simulated bias and dark current."""
+    ccd = sim_tools.CCD(seed=1000)
     ccd.add_bias()
     ccd.add_dark_current()
+    return dict((amp, seg.image.getArray().copy())
+                for amp, seg in ccd.segments.items())
+
+
+def crosstalk_frames(dn=2000, x=250, y=250, radius=20):
+    """
+    Generate the single aggressor crosstalk frames for all of the amps.
+    The bias and dark current levels are the same for every aggressor,
+    so they are simulated once, and the frames share segment image
+    buffers, so each frame is overwritten by the next one.
+    """
+    bias_dark = bias_dark_arrays()
+    buffers = dict((amp, np.empty_like(arr))
+                   for amp, arr in bias_dark.items())
+    for agg in _ALL_AMPS:
+        xtalk_frac = sim_tools.xtalk_pattern(agg)
+        yield generate_crosstalk_frame(agg, dn, x, y, radius,
+                                       xtalk_frac=xtalk_frac,
+                                       bias_dark=bias_dark, buffers=buffers)
+
+
+def generate_crosstalk_frame(aggressor, dn, x, y, radius,
+                             xtalk_frac=None, nom_frac=0.1, bias_dark=None,
+                             buffers=None):
+    if xtalk_frac is None:
+        xtalk_frac = dict((amp, nom_frac) for amp in _ALL_AMPS)
+    ccd = sim_tools.CCD(buffers=buffers)
+    if bias_dark is None:
+        if buffers is not None:
+            for amp in ccd.segments:
+                ccd.segments[amp].image.getArray().fill(0)
+        ccd.add_bias()
+        ccd.add_dark_current()
+    else:
+        # This overwrites any previous contents of the buffers.
+        for amp in ccd.segments:
+            np.copyto(ccd.segments[amp].image.getArray(), bias_dark[amp])
+    # The unit spot image is cached, so just add scaled copies to
+    # each segment.
+    stamp = sim_tools.spot_stamp(radius)
     for amp in ccd.segments:
         if amp == aggressor:
-            ccd.segments[amp].add_spot_image(dn, x, y, radius)
+            scale = dn
         else:
-            ccd.segments[amp].add_spot_image(dn*xtalk_frac[amp], x, y, radius)
+            scale = dn*xtalk_frac[amp]
+        ccd.segments[amp].add_scaled_stamp(stamp, x, y, scale)
     return ccd
 
 
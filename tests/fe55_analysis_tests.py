@@ -7,6 +7,7 @@ import unittest
 import itertools
 import numpy as np
 import lsst.eotest.sensor as sensorTest
+import lsst.eotest.sensor.sim_tools as sim_tools
 
 
 class Fe55GainFitterTestCase(unittest.TestCase):
@@ -78,6 +79,80 @@ class Fe55PsfTestCase(unittest.TestCase):
         for i in list(range(4)) + list(range(5, 9)):
             self.assertGreater(p9_model[4], p9_model[i])
 
+    def test_psf_jac(self):
+        "Test the analytic Jacobian against finite differences."
+        pos = np.array([(x, y) for x, y in
+                        itertools.product(range(5), range(5))],
+                       dtype=np.float64).T
+        pars = np.array((2.2, 1.8, 0.4, 0.5, 300.))
+        jac = sensorTest.fe55_psf.psf_jac(pos, *pars)
+        self.assertEqual(jac.shape, (pos.shape[1], len(pars)))
+        eps = 1e-6
+        for i in range(len(pars)):
+            dpars = np.zeros(len(pars))
+            dpars[i] = eps
+            deriv = (sensorTest.fe55_psf.psf_func(pos, *(pars + dpars))
+                     - sensorTest.fe55_psf.psf_func(pos, *(pars - dpars)))/(2*eps)
+            np.testing.assert_allclose(jac[:, i], deriv, atol=1e-5)
+
+    def test_zero_sigma(self):
+        "Test that sigma = 0 gives the same results as the numpy code."
+        fe55_psf = sensorTest.fe55_psf
+        pos = np.array([(x, y) for x, y in
+                        itertools.product(range(5), range(5))],
+                       dtype=np.float64).T
+        for sigmax, sigmay in ((0, 1.8), (2.2, 0), (0, 0)):
+            pars = (2.3, 1.7, sigmax, sigmay, 300.)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                dn = fe55_psf.psf_func(pos, *pars)
+                jac = fe55_psf.psf_jac(pos, *pars)
+                dn_np = pars[-1]*fe55_psf.pixel_integral(pos[0], pos[1],
+                                                         *pars[:4])
+                derivs = fe55_psf.pixel_integral_derivs(pos[0], pos[1],
+                                                        *pars[:4])
+            jac_np = np.column_stack([pars[-1]*_ for _ in derivs[1:]]
+                                     + [derivs[0]])
+            self.assertTrue(np.all(np.isfinite(dn)))
+            np.testing.assert_allclose(dn, dn_np)
+            np.testing.assert_allclose(jac, jac_np, equal_nan=True)
+
+
+class PsfGaussFitTestCase(unittest.TestCase):
+    "Test case class for PsfGaussFit"
+    amps = (1, 2)
+
+    @classmethod
+    def setUpClass(cls):
+        sim = sim_tools.CCD(amps=cls.amps, gain=1, seed=1000)
+        sim.add_bias(level=1e4, sigma=4)
+        rng = np.random.default_rng(1000)
+        for segment in sim.segments.values():
+            ny, nx = segment.imarr.shape
+            for x0, y0 in zip(rng.uniform(10, nx - 10, 100),
+                              rng.uniform(10, ny - 10, 100)):
+                ix, iy = int(x0), int(y0)
+                yy, xx = np.mgrid[iy-3:iy+4, ix-3:ix+4]
+                pos = np.array((xx.ravel(), yy.ravel()), dtype=np.float64)
+                segment.imarr[yy, xx] += sensorTest.fe55_psf.psf_func(
+                    pos, x0, y0, 0.35, 0.35, 1600.).reshape(xx.shape)
+        cls.ccd = sensorTest.MaskedCCD(sim)
+
+    def _fit(self, nproc):
+        fitter = sensorTest.PsfGaussFit(nproc=nproc)
+        for amp in self.amps:
+            fitter.process_image(self.ccd, amp)
+        fitter.close()
+        return fitter
+
+    def test_nproc(self):
+        "Test that fitting in a process pool gives the same results."
+        serial = self._fit(1)
+        parallel = self._fit(2)
+        self.assertGreater(len(serial.dn), 0)
+        for attr in ('sigmax', 'sigmay', 'dn', 'dn_fp', 'chiprob', 'amp'):
+            np.testing.assert_array_equal(getattr(serial, attr),
+                                          getattr(parallel, attr))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -49,5 +49,35 @@ class SegmentExposureTestCase(unittest.TestCase):
             self.seg.expose_flat(intensity=self.intensity)
 
 
+class CCDSeedTestCase(unittest.TestCase):
+    """Test that the simulated frames are reproducible."""
+
+    @staticmethod
+    def _simulate(seed=None):
+        ccd = sim_tools.CCD(amps=(1, 2), seed=seed)
+        ccd.add_bias()
+        ccd.add_dark_current(level=10)
+        for segment in ccd.segments.values():
+            segment.add_bright_cols(segment.generate_bright_cols(2))
+            segment.add_bright_pix(segment.generate_bright_pix(20))
+        ccd.add_Fe55_hits(nxrays=100)
+        return [ccd.segments[amp].image.getArray().copy()
+                for amp in ccd.segments]
+
+    def _assert_equal_frames(self, frames1, frames2):
+        for imarr1, imarr2 in zip(frames1, frames2):
+            np.testing.assert_array_equal(imarr1, imarr2)
+
+    def test_seed(self):
+        self._assert_equal_frames(self._simulate(seed=1000),
+                                  self._simulate(seed=1000))
+
+    def test_global_seed(self):
+        np.random.seed(1000)
+        frames = self._simulate()
+        np.random.seed(1000)
+        self._assert_equal_frames(frames, self._simulate())
+
+
 if __name__ == '__main__':
     unittest.main()